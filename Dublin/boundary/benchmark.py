@@ -0,0 +1,291 @@
+from netCDF4 import Dataset
+from contextlib import contextmanager
+import numpy as np
+import tracemalloc
+import argparse
+import logging
+import platform
+import shutil
+import json
+import time
+import sys
+import os
+
+# PISCES variables, in the order they are added to the benchmark. The
+# variables needed for total alkalinity come first, then TALK itself.
+PISCES = ('DIC', 'pH', 'NH4', 'PO4', 'Si', 'TALK', 'NO3', 'O2', 'FER')
+
+# Range of the synthetic values for each variable
+RANGES = {'zeta': (-1., 1.), 'ubar': (-.5, .5), 'vbar': (-.5, .5),
+        'temp': (8., 12.), 'salt': (34., 35.5), 'DIC': (2.05, 2.15),
+        'pH': (7.95, 8.1), 'NH4': (0., .5), 'PO4': (.2, .8), 'Si': (1., 5.),
+        'NO3': (1., 10.), 'O2': (220., 300.), 'FER': (0., .001)}
+
+class Timer:
+    ''' Wall time and peak memory of each stage of the benchmark. Stages
+    can be nested. Memory is the peak of the allocations traced by
+    tracemalloc (which include NumPy arrays) in this process, so
+    worker processes are not included. '''
+
+    def __init__(self):
+        self.stages, self.peaks = {}, []
+        tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        # Keep peak so far for the enclosing stage, then start measuring this one
+        if self.peaks:
+            self.peaks[-1] = max(self.peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak(); self.peaks.append(0)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self.peaks: # Pass peak to the enclosing stage
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            self.stages[name] = dict(time=elapsed, memory=peak / 1024**2)
+            print(f'{name:>20s}: {elapsed:9.3f} s {peak / 1024**2:10.1f} MB')
+
+def timed(timer, name, function):
+    ''' Wrap FUNCTION so that every call is measured as stage NAME '''
+    def wrapper(*args, **kwargs):
+        with timer.stage(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+def write_config(source, filename, settings):
+    ''' Copy configuration file SOURCE to FILENAME, replacing the values
+    of the keywords in SETTINGS. Keywords set to None are removed. '''
+
+    lines, found = [], set()
+    with open(source, 'r') as f:
+        for line in f:
+            key = line.split()[0] if line.strip() and line[0] != '!' else None
+            if key in settings:
+                found.add(key)
+                if settings[key] is None:
+                    continue
+                line = f'{key} {settings[key]}\n'
+            lines.append(line)
+
+    # Keywords not in the original file
+    for key, value in settings.items():
+        if key not in found and value is not None:
+            lines.append(f'{key} {value}\n')
+
+    with open(filename, 'w') as f:
+        f.writelines(lines)
+
+def synthetic_grid(config, filename, Mp, Lp):
+    ''' Create a synthetic CROCO grid with Mp x Lp RHO points, inside
+    the Copernicus download area set in the configuration file. '''
+
+    west, east, south, north = (float(config.get(k)) for k in ('west', 'east', 'south', 'north'))
+
+    # Keep some margin from the edges of the Copernicus area
+    lon = np.linspace(west + .1 * (east - west), east - .1 * (east - west), Lp)
+    lat = np.linspace(south + .1 * (north - south), north - .1 * (north - south), Mp)
+    lon_rho, lat_rho = np.meshgrid(lon, lat)
+
+    # Bathymetry deepening offshore, with some land along the western edge
+    h = 5. + 95. * np.linspace(0, 1, Lp)[None, :] * np.ones((Mp, 1))
+    mask = np.ones((Mp, Lp)); mask[:, 0:max(1, Lp // 10)] = 0
+
+    with Dataset(filename, 'w', format='NETCDF4') as nc:
+        nc.createDimension('eta_rho', Mp); nc.createDimension('xi_rho', Lp)
+        nc.createDimension('eta_v', Mp - 1); nc.createDimension('xi_u', Lp - 1)
+
+        fields = {
+            'lon_rho': (('eta_rho', 'xi_rho'), lon_rho),
+            'lat_rho': (('eta_rho', 'xi_rho'), lat_rho),
+            'lon_u': (('eta_rho', 'xi_u'), .5 * (lon_rho[:, 1:] + lon_rho[:, :-1])),
+            'lat_u': (('eta_rho', 'xi_u'), .5 * (lat_rho[:, 1:] + lat_rho[:, :-1])),
+            'lon_v': (('eta_v', 'xi_rho'), .5 * (lon_rho[1:, :] + lon_rho[:-1, :])),
+            'lat_v': (('eta_v', 'xi_rho'), .5 * (lat_rho[1:, :] + lat_rho[:-1, :])),
+            'h': (('eta_rho', 'xi_rho'), h),
+            'mask_rho': (('eta_rho', 'xi_rho'), mask),
+            'mask_u': (('eta_rho', 'xi_u'), mask[:, 1:] * mask[:, :-1]),
+            'mask_v': (('eta_v', 'xi_rho'), mask[1:, :] * mask[:-1, :])}
+        for name, (dimensions, value) in fields.items():
+            nc.createVariable(name, 'f8', dimensions)[:] = value
+
+def synthetic_cmems(config, filename, variable, time, units, lat, lon, depth, rng):
+    ''' Create a synthetic Copernicus file for VARIABLE, with the structure
+    of a CMEMS download. DEPTH is None for 2-D variables. Land is masked
+    along the western edge and, for 3-D variables, below 80 m. '''
+
+    cdfvar = config.get(variable)[2]
+    a, b = RANGES[variable]
+
+    M, L = len(lat), len(lon)
+    land = np.zeros((M, L), dtype=bool); land[:, 0:max(1, L // 10)] = True
+
+    with Dataset(filename, 'w', format='NETCDF4') as nc:
+        nc.createDimension('time', len(time))
+        nc.createDimension('latitude', M)
+        nc.createDimension('longitude', L)
+        dimensions = ('time', 'latitude', 'longitude')
+        if depth is not None:
+            nc.createDimension('depth', len(depth))
+            nc.createVariable('depth', 'f4', ('depth',))[:] = depth
+            dimensions = ('time', 'depth', 'latitude', 'longitude')
+            land = land | (depth[:, None, None] > 80.)
+
+        timevar = nc.createVariable('time', 'f8', ('time',))
+        timevar.units = units; timevar[:] = time
+        nc.createVariable('latitude', 'f4', ('latitude',))[:] = lat
+        nc.createVariable('longitude', 'f4', ('longitude',))[:] = lon
+
+        var = nc.createVariable(cdfvar, 'f4', dimensions, fill_value=-32767.)
+        var.standard_name = cdfvar; var.units = '1'
+        # Write one record at a time, so that large sizes fit in memory
+        for t in range(len(time)):
+            data = a + (b - a) * rng.random(land.shape)
+            var[t] = np.ma.masked_array(data, land)
+
+def synthetic_data(config, args, path, idate, idatestr, edate, edatestr):
+    ''' Create the synthetic CROCO grid and Copernicus files in PATH,
+    covering the period from IDATE to EDATE '''
+
+    days = (edate - idate).days
+
+    synthetic_grid(config, config.get('grdname'), args.eta, args.xi)
+
+    west, east, south, north = (float(config.get(k)) for k in ('west', 'east', 'south', 'north'))
+    lon = np.linspace(west, east, args.lon)
+    lat = np.linspace(south, north, args.lat)
+    depth = np.geomspace(.5, 150., args.depth)
+
+    units = f'minutes since {idate.strftime("%Y-%m-%d %H:%M:%S")}'
+    hourly = np.arange(days * args.steps + 1) * 1440. / args.steps
+    daily = np.arange(days + 1) * 1440.
+
+    rng = np.random.default_rng(0)
+    for v in ('zeta', 'ubar', 'vbar', 'temp', 'salt') + PISCES:
+        if config.get(v)[0] != 'Y' or v == 'TALK':
+            continue # Not selected, or calculated from the other PISCES variables
+        synthetic_cmems(config, f'{path}/cmems-{v}-{idatestr}-{edatestr}.nc', v,
+                hourly if v in ('zeta', 'ubar', 'vbar') else daily, units,
+                lat, lon, None if v in ('zeta', 'ubar', 'vbar') else depth, rng)
+
+def compare(results, baseline, tolerance):
+    ''' Compare RESULTS against BASELINE results. Return the list of
+    stages whose time or memory grew more than TOLERANCE (e.g. 0.2) '''
+
+    regressions = []
+    for name, stage in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if reference is None:
+            continue
+        for metric in ('time', 'memory'):
+            if stage[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f'{name} {metric}: {stage[metric]:.3f} '
+                        f'(baseline {reference[metric]:.3f})')
+    return regressions
+
+def main(argv=None):
+
+    msg = ''' Benchmark the CROCO boundary forcing pipeline (total alkalinity and
+              make_boundary) on synthetic Copernicus files and a synthetic CROCO grid,
+              with no network access. Wall time and peak memory of each stage are
+              written to a JSON file. If a baseline JSON is given, the benchmark fails
+              (exit status 1) when any stage is slower or uses more memory than the
+              baseline plus the tolerance. '''
+
+    # Initialize argument parser
+    parser = argparse.ArgumentParser(description=msg)
+    # Define command-line arguments
+    parser.add_argument('--config', default='config', help='Configuration file to start from')
+    parser.add_argument('--workdir', default='benchmark', help='Directory for the synthetic files (removed first)')
+    parser.add_argument('--eta', type=int, default=100, help='CROCO grid RHO points, eta direction')
+    parser.add_argument('--xi', type=int, default=100, help='CROCO grid RHO points, xi direction')
+    parser.add_argument('-N', type=int, default=20, help='CROCO S-levels')
+    parser.add_argument('--lat', type=int, default=60, help='Copernicus grid points, latitude')
+    parser.add_argument('--lon', type=int, default=60, help='Copernicus grid points, longitude')
+    parser.add_argument('--depth', type=int, default=30, help='Copernicus depth levels')
+    parser.add_argument('--days', type=int, default=5, help='Length of the period, in days')
+    parser.add_argument('--steps', type=int, default=24, help='Records per day of 2-D variables')
+    parser.add_argument('--pisces', type=int, default=len(PISCES), help='Number of PISCES variables (0 to 9)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+            help='Any other configuration keyword, e.g. --set bryworkers=4')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='Results (JSON)')
+    parser.add_argument('--baseline', help='Baseline results (JSON) to check against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed increase over the baseline (0.2 is 20%%)')
+
+    # Read arguments from command line
+    args = parser.parse_args(argv)
+
+    source = os.path.abspath(args.config)
+    output = os.path.abspath(args.output)
+    baseline = args.baseline and os.path.abspath(args.baseline)
+    path = os.path.abspath(args.workdir)
+
+    ''' Set up a clean working directory with its own configuration file '''
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path + '/cmems'); os.makedirs(path + '/out')
+
+    selected = PISCES[0:args.pisces]
+    settings = {'mydate': '20250301', 'days-back': 0, 'days-ahead': args.days - 1,
+            'grdname': path + '/croco_grd.nc', 'cmemspath': path + '/cmems',
+            'hindpath': path + '/out', 'N': args.N, 'PISCES': 'T' if selected else 'F',
+            'weightspath': None, 'cmemscache': None, 'bryworkers': 1, 'talkworkers': 1,
+            'brylog': path + '/boundary.config'} # Never overwrite the operational /log
+    settings.update(dict(i.split('=', 1) for i in args.set))
+    write_config(source, path + '/config', settings)
+
+    # Log to the working directory. The logger of main (see log.py) then leaves /log/app.log alone
+    logging.basicConfig(filename=path + '/app.log', format='%(message)s', filemode='w', level=logging.INFO)
+
+    # Select the PISCES variables for this benchmark
+    os.chdir(path)
+    import main as boundary
+    config = boundary.configuration()
+    for v in PISCES:
+        settings[v] = ('Y ' + ' '.join(config.get(v)[1:])) if v in selected else 'N'
+    write_config(path + '/config', path + '/config', settings)
+    config = boundary.configuration()
+
+    timer = Timer()
+
+    ''' Run the pipeline, measuring each stage '''
+    # Dates, exactly as in make_boundary
+    idate, idatestr, edate, edatestr = boundary.get_dates(config)
+
+    with timer.stage('synthetic data'):
+        synthetic_data(config, args, path + '/cmems', idate, idatestr, edate, edatestr)
+
+    if 'TALK' in selected:
+        with timer.stage('total_alkalinity'):
+            boundary.total_alkalinity(config, idatestr, edatestr)
+
+    boundary.create_bry = timed(timer, 'create_bry', boundary.create_bry)
+    boundary.make_bry_variables = timed(timer, 'make_bry_variables', boundary.make_bry_variables)
+    with timer.stage('make_boundary'):
+        boundary.make_boundary()
+
+    results = dict(
+            sizes=dict(eta=args.eta, xi=args.xi, N=args.N, lat=args.lat, lon=args.lon,
+                depth=args.depth, days=args.days, steps=args.steps, pisces=list(selected)),
+            settings={k: settings[k] for k in settings if k not in PISCES},
+            python=platform.python_version(), numpy=np.__version__,
+            stages=timer.stages)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f'Results written to {output}')
+
+    ''' Check against baseline '''
+    if baseline:
+        with open(baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for i in regressions:
+            print(f'REGRESSION {i}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+
+if __name__ == '__main__':
+    main()
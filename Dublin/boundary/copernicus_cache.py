@@ -0,0 +1,223 @@
+from netCDF4 import Dataset, num2date, date2num
+from datetime import date, datetime, timedelta
+from log import set_logger, now
+import numpy as np
+import glob
+import os
+
+logger = set_logger()
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+def copy_cmems(src, filename, cdfvar, skip=(), records=None, attributes={}):
+    ''' Copy Copernicus variable CDFVAR, together with all coordinates and
+    attributes, from the open NetCDF SRC into a new file FILENAME, where:
+
+    skip: other data variables in SRC that should not be copied.
+
+    records: time indices to copy (all if None). Time is always written
+             as an unlimited dimension, so that it can be empty if there
+             are no records, and more records can be appended later.
+
+    attributes: additional global attributes for the new file. '''
+
+    src.set_auto_maskandscale(False) # Copy raw values
+
+    with Dataset(filename, 'w', format='NETCDF4') as dst:
+        dst.set_auto_maskandscale(False)
+        dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+        dst.setncatts(attributes)
+
+        for name, dim in src.dimensions.items():
+            if 'time' in name:
+                dst.createDimension(name, None)
+            else:
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+        for name, var in src.variables.items():
+            if name in skip and name != cdfvar:
+                continue # Skip the other ocean variables in this dataset
+            out = dst.createVariable(name, var.datatype, var.dimensions,
+                    zlib=var.filters().get('zlib', False),
+                    fill_value=getattr(var, '_FillValue', None))
+            out.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'})
+
+            if records is not None and var.dimensions and 'time' in var.dimensions[0]:
+                if len(records):
+                    # Read only the range of records needed
+                    first, last = min(records), max(records)
+                    out[0:len(records)] = var[first:last + 1][np.asarray(records) - first]
+            else:
+                out[:] = var[:]
+
+def tile_name(config, dataset, cdfvar, day):
+    ''' Path to the cached tile of Copernicus variable CDFVAR from
+    DATASET for DAY. The area is part of the name, so that changes
+    in the model boundaries never reuse tiles from another area. '''
+
+    bbox = '_'.join(config.get(k) for k in ('west', 'east', 'south', 'north'))
+    return (f'{config.get("cmemscache")}/{dataset}/{cdfvar}/'
+            f'{cdfvar}-{day.strftime("%Y%m%d")}-{bbox}.nc')
+
+def required_production(config, day, today, latest=None):
+    ''' Earliest production time of a cached tile for DAY that is still
+    up to date, for a run on TODAY. LATEST is the time of the last update
+    of the product, if known. Recent and forecast days (those after today
+    minus "cmemsupdate" days) change with every new production, so these
+    must come from the last one (or, if not known, from today). If
+    "cmemsweekly" is set, past days are reissued once a week, on that day
+    of the week. Older days are never updated. '''
+
+    if day >= today - timedelta(days=int(config.get('cmemsupdate', 0))):
+        return latest or datetime.combine(today, datetime.min.time())
+
+    weekly = config.get('cmemsweekly')
+    if weekly:
+        # Last weekly production, up to today
+        last = today - timedelta(days=(today.weekday() - WEEKDAYS.index(weekly)) % 7)
+        if day < last:
+            # Unless the product has not been updated since
+            last = datetime.combine(last, datetime.min.time())
+            return min(last, latest) if latest else last
+
+    return datetime.min
+
+def production_time(nc):
+    ''' Production time of the open tile NC '''
+
+    try:
+        return datetime.strptime(nc.production_date, '%Y-%m-%dT%H:%M:%S')
+    except ValueError: # Tiles cached before the time was recorded
+        return datetime.strptime(nc.production_date, '%Y%m%d')
+
+def missing_days(config, dataset, cdfvars, days, today, latest=None):
+    ''' List the days for which any of the Copernicus variables CDFVARS
+    from DATASET has no cached tile, or a tile that has been superseded.
+    LATEST is the time of the last update of the product, if known. '''
+
+    missing = []
+    for day in days:
+        required = required_production(config, day, today, latest)
+        for cdfvar in cdfvars:
+            f = tile_name(config, dataset, cdfvar, day)
+            if not os.path.isfile(f):
+                missing.append(day); break
+            with Dataset(f, 'r') as nc:
+                production = production_time(nc)
+            if production < required:
+                missing.append(day); break
+    return missing
+
+def contiguous(days):
+    ''' Group sorted list of days into (first, last) contiguous periods '''
+
+    periods = []
+    for day in days:
+        if periods and day - periods[-1][1] == timedelta(days=1):
+            periods[-1][1] = day
+        else:
+            periods.append([day, day])
+    return [tuple(i) for i in periods]
+
+def write_tiles(config, dataset, f, cdfvars, days, today, production):
+    ''' Split a Copernicus file F, downloaded from DATASET for the
+    given DAYS, into one tile per variable and day. Tiles are tagged
+    with the PRODUCTION time of the product. Days without any records
+    get an empty tile, so that they are not requested again until
+    superseded. '''
+
+    with Dataset(f, 'r') as nc:
+        time = num2date(nc.variables['time'][:], nc.variables['time'].units)
+        time = np.array([date(i.year, i.month, i.day) for i in time])
+
+        for cdfvar in cdfvars:
+            path = os.path.dirname(tile_name(config, dataset, cdfvar, today))
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for day in days:
+                tile = tile_name(config, dataset, cdfvar, day)
+                # Write to a temporary file first, so that a failed run never leaves half a tile
+                copy_cmems(nc, tile + '.tmp', cdfvar, skip=cdfvars,
+                        records=np.where(time == day)[0],
+                        attributes={'production_date': production.strftime('%Y-%m-%dT%H:%M:%S')})
+                os.replace(tile + '.tmp', tile)
+
+def assemble_tiles(config, dataset, cdfvar, filename, idate, edate):
+    ''' Concatenate the cached tiles of Copernicus variable CDFVAR from
+    DATASET into FILENAME, covering from IDATE to EDATE (both included),
+    exactly as if the whole period had been downloaded at once. '''
+
+    idate = datetime.combine(idate, datetime.min.time()) # Datetime required
+    edate = datetime.combine(edate, datetime.min.time()) # Datetime required
+
+    days = [idate.date() + timedelta(days=i) for i in range((edate - idate).days + 1)]
+    tiles = [tile_name(config, dataset, cdfvar, day) for day in days]
+
+    # Read time and data from each tile
+    time, data = [], []
+    for tile in tiles:
+        with Dataset(tile, 'r') as nc:
+            nc.set_auto_maskandscale(False)
+            if not len(nc.variables['time']):
+                continue
+            t = num2date(nc.variables['time'][:], nc.variables['time'].units)
+            w = np.array([idate <= datetime(i.year, i.month, i.day, i.hour, i.minute, i.second)
+                <= edate for i in t])
+            time.extend(t[w]); data.append(nc.variables[cdfvar][:][w])
+
+    # Use the first tile as template for coordinates and attributes
+    with Dataset(tiles[0], 'r') as nc:
+        copy_cmems(nc, filename, cdfvar, records=[],
+                attributes={'production_date': nc.production_date})
+
+    with Dataset(filename, 'a') as nc:
+        nc.set_auto_maskandscale(False)
+        if time:
+            nc.variables['time'][:] = date2num(time, nc.variables['time'].units)
+            nc.variables[cdfvar][:] = np.concatenate(data)
+
+def cached_download(config, download, dataset, cdfvars, files, idate, edate, today, latest=None):
+    ''' Download Copernicus variables CDFVARS from DATASET through the
+    local tile cache. Only missing or superseded days are requested with
+    DOWNLOAD(filename, variables, start, end). Then, the per-variable
+    files FILES (mapping file names to CMEMS variable names) are assembled
+    from the cached tiles.
+
+    LATEST is the time of the last update of the product, as reported by
+    Copernicus. Tiles are tagged with it, so that they are downloaded again
+    when the product is updated. If not known, the download time is used. '''
+
+    idate = datetime.combine(idate, datetime.min.time()) # Datetime required
+    edate = datetime.combine(edate, datetime.min.time()) # Datetime required
+
+    days = [idate.date() + timedelta(days=i) for i in range((edate - idate).days + 1)]
+
+    missing = missing_days(config, dataset, cdfvars, days, today, latest)
+    # Production time of the tiles downloaded now
+    production = latest or datetime.now().replace(microsecond=0)
+    logger.info(f'{now()} {dataset}: {len(days) - len(missing)} of {len(days)} days found in cache')
+
+    for first, last in contiguous(missing):
+        # Download whole days, so that every tile is complete
+        start = datetime.combine(first, datetime.min.time())
+        end = datetime.combine(last, datetime.min.time()) + timedelta(days=1, seconds=-1)
+
+        filename = f'{dataset}-{first.strftime("%Y%m%d")}-{last.strftime("%Y%m%d")}.nc'
+        download(filename, cdfvars, start, end)
+
+        f = config.get('cmemspath') + '/' + filename
+        write_tiles(config, dataset, f, cdfvars,
+                [i for i in missing if first <= i <= last], today, production)
+        os.remove(f)
+
+    for filename, cdfvar in files.items():
+        assemble_tiles(config, dataset, cdfvar, filename, idate, edate)
+
+def clean_cache(config, idate):
+    ''' Remove cached tiles for days before IDATE, which will not be needed again '''
+
+    oldest = idate.strftime('%Y%m%d')
+    for f in glob.glob(config.get('cmemscache') + '/**/*.nc', recursive=True):
+        if os.path.basename(f).split('-')[1] < oldest:
+            logger.info(f'{now()} Deleting {f}')
+            os.remove(f)
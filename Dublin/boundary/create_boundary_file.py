@@ -31,7 +31,7 @@ def create_bry(config):
     if os.path.isfile(abspath):
         os.remove(abspath)
 
-    with Dataset(abspath, 'w', format='NETCDF4'):
+    with Dataset(abspath, 'w', format='NETCDF4') as nc:
         ''' Create global attributes '''
         nc.title = config.get('title')
         nc.date = date.today().strftime('%Y-%b-%d')
@@ -625,6 +625,7 @@ def create_bry(config):
         if config.get('PISCES') == 'T':
             if config.get('DIC')[0] == 'Y': 
                 dic_time[:] = pisces_time
+            if config.get('TALK')[0] == 'Y':
                 talk_time[:] = pisces_time
             if config.get('NO3')[0] == 'Y':
                 no3_time[:] = pisces_time
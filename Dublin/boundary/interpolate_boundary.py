@@ -1,15 +1,28 @@
-from scipy.interpolate import RegularGridInterpolator
+from interpolation_weights import BOUNDARIES, boundary_edge, boundary_strip
+from interpolation_weights import get_weights, interpolate, boundary_slab
 from netCDF4 import Dataset, num2date
 from scoordinate import scoord2z
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from log import set_logger, now
+import multiprocessing
 import numpy as np
 import glob
+import os
+
+logger = set_logger()
 
 PISCES = ('DIC', 'TALK', 'pH', 'NO3', 'NH4', 'PO4', 'Si', 'O2', 'FER')
 
-def vertical_interpolations(config, H, z, data, mask, variable):
-    ''' Perform vertical interpolations from CMEMS product
-    to CROCO boundary, where:
+# CROCO grid type of each ocean variable
+GRIDTYPE = {'temp': 'rho', 'salt': 'rho', 'zeta': 'rho', 'pH': 'rho',
+        'DIC': 'rho', 'NO3': 'rho', 'NH4': 'rho', 'PO4': 'rho',
+        'Si': 'rho', 'FER': 'rho', 'O2': 'rho', 'TALK': 'rho',
+        'u': 'u', 'ubar': 'u', 'v': 'v', 'vbar': 'v'}
+
+def vertical_weights(config, H, z):
+    ''' Precompute vertical interpolation weights from CMEMS depths
+    to CROCO S-levels along a boundary, where:
 
     config: options set in configuration file, including
             the desired CROCO vertical coordinate set up.
@@ -20,17 +33,9 @@ def vertical_interpolations(config, H, z, data, mask, variable):
     z: CMEMS product depth list (Z x 1) 1-D array
        where Z is the number of vertical levels in CMEMS.
 
-    data: CMEMS 3-D ocean data already horizontally 
-          interpolated to CROCO boundary (n x Z) 2-D array.
-
-    mask: CROCO land/sea mask along boundary (n x 1) 1-D array
-          Used to skip computations on land.
-          
-    variable: variable name being processed.
-
-    Returns an N x n 2-D array, where N is the number of 
-    vertical levels in CROCO and n is the length of the boundary.
-     '''
+    z_rho only depends on the bathymetry and the S-coordinate set up,
+    so it is computed once for the whole boundary. The result can be
+    reused for every time step and every variable on the same grid. '''
 
     # Get CROCO vertical coordinate 
     if int(config.get('Vtransform')) == 1:
@@ -43,123 +48,226 @@ def vertical_interpolations(config, H, z, data, mask, variable):
     N = int(config.get('N')) # Number of S levels
     hc = float(config.get('hc')) # Critical depth
 
-    out = -10*np.ones((N, len(H))) # Output initialization
+    H = np.array(np.ma.getdata(H), dtype=np.float64)
+    z = np.asarray(np.ma.getdata(z), dtype=np.float64)
 
-    for i, (h, m) in enumerate(zip(H, mask)):
-        if m == 0: 
-            out[:,i] = -999.9; continue # Add dummy value on land
+    [z_rho, Cs_rho, sc_rho] = scoord2z('r', 
+            np.zeros(len(H)), H, theta_s, theta_b, N, hc, scoord=scoord)
 
-        data_i = fill_mask(data[:,i], variable)
+    # CROCO depths (positive down) for every level and boundary point
+    depth = -z_rho.reshape(N, len(H))
 
-        [z_rho, Cs_rho, sc_rho] = scoord2z('r', 
-                np.array([0]), np.array([h]),
-                theta_s, theta_b, N, hc, scoord=scoord)
+    # Index of the CMEMS level right above each CROCO level
+    j = np.clip(np.searchsorted(z, depth, side='right') - 1, 0, len(z) - 2)
 
-        out[:,i] = np.interp(-z_rho, z, data_i) # Vertical interpolation
+    return dict(
+        j = j,
+        # Distance to the CMEMS level above (zero if above the first CMEMS level)
+        dz = np.maximum(depth, z[0]) - z[j],
+        # Distance between bracketing CMEMS levels
+        dx = z[j+1] - z[j],
+        # CROCO levels below the last CMEMS level
+        deep = depth >= z[-1])
 
-    return out
+def get_vertical_weights(config, gridType, boundary, grid, depth):
+    ''' Return vertical interpolation weights for this boundary. These
+    are shared by all variables on the same grid type and CMEMS depths,
+    so they are computed once and kept in config. '''
 
-def interp_time2d(config, time, v):
-    '''      Linearly interpolate 2-D variable 
-    from its native time array to the master time array ''' 
+    key = (gridType, boundary, np.asarray(depth).tobytes())
+    cache = config.setdefault('vertical-weights', {})
+    if key not in cache:
+        cache[key] = vertical_weights(config, grid[boundary]['h'], depth)
+    return cache[key]
 
-    offset = datetime.strptime(config.get('offset'), '%Y%m%d')
+def vertical_interpolations(weights, data, mask, variable):
+    ''' Perform vertical interpolations from CMEMS product
+    to CROCO boundary, where:
 
-    # Convert times to time stamps
-    time = np.array([datetime(i.year, i.month, i.day,
-        i.hour, i.minute) for i in time])
-    time = np.array([(i - offset).total_seconds()/86400 for i in time])
+    weights: vertical interpolation weights for this boundary,
+             as returned by vertical_weights.
 
-    # Load master time array
-    master = config.get('time')
+    data: CMEMS 3-D ocean data already horizontally 
+          interpolated to CROCO boundary (T x Z x n) 3-D array.
 
-    # Get variable dimenions
-    T, X = v.shape
+    mask: CROCO land/sea mask along boundary (n x 1) 1-D array
+          Used to flag values on land.
+          
+    variable: variable name being processed.
 
-    # Output initialization
-    out = -10*np.ones((len(master), X))
+    Returns a T x N x n 3-D array, where N is the number of 
+    vertical levels in CROCO and n is the length of the boundary.
+    All time steps are interpolated in a single pass. This is the
+    same as running np.interp on every column and time step.
+     '''
+
+    T, Z, n = data.shape
+
+    # Fill missing values along each column
+    data = fill_mask(data, variable, axis=1)
 
-    for i in range(X):
-        out[:,i] = np.interp(master, time, v[:,i])
+    j, dz, dx = weights['j'], weights['dz'], weights['dx']
+
+    # Values at the CMEMS levels bracketing each CROCO level
+    columns = np.arange(n)
+    f0, f1 = data[:, j, columns], data[:, j+1, columns]
+
+    # Vertical interpolation
+    out = (f1 - f0) / dx * dz + f0
+    # Below the last CMEMS level, use the deepest value
+    out = np.where(weights['deep'], data[:, -1:, :], out)
+    # Add dummy value on land
+    out[:, :, np.ma.getdata(mask) == 0] = -999.9
 
     return out
 
-def interp_time3d(config, time, v):
-    '''      Linearly interpolate 3-D variable 
-    from its native time array to the master time array ''' 
+def time_stamps(config, time):
+    ''' Convert native time array (datetime objects) 
+    to days since the CROCO reference time '''
 
     offset = datetime.strptime(config.get('offset'), '%Y%m%d')
 
-    # Convert times to time stamps
-    time = np.array([datetime(i.year, i.month, i.day,
-        i.hour, i.minute) for i in time])
-    time = np.array([(i - offset).total_seconds()/86400 for i in time])
+    return np.array([(datetime(i.year, i.month, i.day,
+        i.hour, i.minute) - offset).total_seconds()/86400 for i in time])
+
+def time_weights(config, time):
+    ''' Precompute linear interpolation weights from a native time
+    array (TIME, days since CROCO reference time) to the master time
+    array. These are shared by every variable (and every boundary) 
+    with the same native time array. '''
 
     # Load master time array
-    master = config.get('time')
+    master = np.asarray(config.get('time'), dtype=np.float64)
 
-    # Get variable dimenions
-    T, N, X = v.shape
+    # Index of the native time right before each master time
+    j = np.clip(np.searchsorted(time, master, side='right') - 1, 0, max(len(time) - 2, 0))
+    k = np.minimum(j + 1, len(time) - 1)
 
-    # Output initialization
-    out = -10*np.ones((len(master), N, X))
+    return dict(
+        j = j, k = k,
+        # Time since the native time before (zero if before the first native time)
+        dt = np.maximum(master, time[0]) - time[j],
+        # Time between bracketing native times
+        dx = np.where(k > j, time[k] - time[j], 1),
+        # Master times after the last native time
+        late = master >= time[-1])
 
-    for i in range(X):
-        for k in range(N):
-            out[:,k,i] = np.interp(master, time, v[:,k,i])
+def get_time_weights(config, time):
+    ''' Return time interpolation weights for native time array TIME
+    (datetime objects). These are shared by all variables with the same
+    native time array, so they are computed once and kept in config. '''
 
-    return out
+    time = time_stamps(config, time)
 
-def fill_mask(data, variable):
-    ''' Fill masked boundary 1-D array with nearest neighbour.
-    This is used to avoid missing values along the boundaries
-    in cells located close to the coast. These missing values
-    result from interpolating from the Copernicus product to
-    the CROCO grid. '''
+    cache = config.setdefault('time-weights', {})
+    if time.tobytes() not in cache:
+        cache[time.tobytes()] = time_weights(config, time)
+    return cache[time.tobytes()]
+
+def interp_time(config, time, v, select=slice(None), start=0):
+    '''      Linearly interpolate variable (T x ...) 
+    from its native time array to the master time array. All
+    points and levels are interpolated in a single operation. 
+    This is the same as running np.interp on every time series. 
 
-    copy = np.copy(data) # Output initialization 
+    In streaming mode, V only holds the native records from index
+    START on, and SELECT gives the master time indices to compute. ''' 
 
-    # Set valid ranges for different ocean parameters
+    weights = get_time_weights(config, time)
+
+    # Broadcast weights along the remaining dimensions
+    shape = (-1,) + (1,) * (v.ndim - 1)
+    dt, dx = weights['dt'][select].reshape(shape), weights['dx'][select].reshape(shape)
+    late = weights['late'][select].reshape(shape)
+
+    f0, f1 = v[weights['j'][select] - start], v[weights['k'][select] - start]
+
+    return np.where(late, v[-1:], (f1 - f0) / dx * dt + f0)
+
+def valid_range(variable):
+    ''' Set valid ranges for different ocean parameters '''
     if variable in ('temp', 'salt'):
-        valid_min, valid_max = 0, 40 # Celsius, PSU   
+        return 0, 40 # Celsius, PSU   
     elif variable in ('u', 'v', 'ubar', 'vbar', 'zeta'):
-        valid_min, valid_max = -5, 5 # m/s, m   
+        return -5, 5 # m/s, m   
     elif variable in ('DIC', 'TALK'):
-        valid_min, valid_max = 1, 3 # mol m-3
+        return 1, 3 # mol m-3
     elif variable in ('NO3', 'PO4', 'NH4', 'Si', 'FER'):
-        valid_min, valid_max = 0, 100 # mmol m-3
+        return 0, 100 # mmol m-3
     elif variable in ('O2',):
-        valid_min, valid_max = 0, 400 # mmol m-3
+        return 0, 400 # mmol m-3
     elif variable in ('pH',):
-        valid_min, valid_max = 7.5, 8.5
+        return 7.5, 8.5
+    raise ValueError(f'No valid range defined for {variable}')
+
+def fill_mask(data, variable, axis=-1):
+    ''' Fill masked boundary array with nearest neighbour along AXIS.
+    This is used to avoid missing values along the boundaries
+    in cells located close to the coast. These missing values
+    result from interpolating from the Copernicus product to
+    the CROCO grid. 
+    
+    DATA can be a whole stack of boundary arrays (e.g. time x depth
+    x points), and every 1-D line along AXIS is filled independently.
+    Ties are resolved in favour of the lower index. Lines without any
+    valid value are returned unchanged. '''
+
+    valid_min, valid_max = valid_range(variable)
 
-    # Identify missing values using the range above
+    data = np.moveaxis(np.asarray(data), axis, -1)
+
+    # Identify missing values using the valid range
     mask = np.logical_or(data < valid_min, data > valid_max)
 
-    # Get indexes of valid, unmasked (ocean) values 
-    w = np.where(mask == False)[0]
+    n = data.shape[-1]; index = np.arange(n)
 
-    if w.size == 0:  return copy
+    # Index of nearest valid value before (forward fill) and after (backward fill)
+    before = np.maximum.accumulate(np.where(mask, -1, index), axis=-1)
+    after = np.flip(np.minimum.accumulate(np.flip(np.where(mask, n, index), 
+        axis=-1), axis=-1), axis=-1)
 
-    for i, masked in enumerate(mask): # Loop along 1-D array
-        if masked: # If value is missing
-            ind = w[np.argmin(abs(w - i))] # Find nearest neighbour index
-            copy[i] = data[ind] # ... and replace with a valid value
-    return copy
+    # Choose the closest one. Use the value itself if there is no valid value at all
+    nearest = np.where(index - before <= after - index, before, after)
+    nearest = np.where((before < 0) & (after >= n), index, 
+            np.where(before < 0, after, np.where(after >= n, before, nearest)))
 
-def interpolate_bry_variable(config, variable):
-    ''' Interpolate CROCO ocean variable for boundary forcing '''
+    copy = np.take_along_axis(data, nearest, axis=-1)
+    return np.moveaxis(copy, -1, axis)
 
-    OpenBoundaries = config.get('OpenBoundaries')
+def read_boundary_grid(config, gridType):
+    ''' Read CROCO longitude, latitude, bathymetry and land/sea mask
+    along the open boundaries only, for the selected grid type ('rho',
+    'u' or 'v'). Only the outermost rows and columns are read from the
+    grid file, so that work scales with the grid perimeter, not its area.
 
-    gridType = {'temp': 'rho', 'salt': 'rho', 'zeta': 'rho', 'pH': 'rho',
-            'DIC': 'rho', 'NO3': 'rho', 'NH4': 'rho', 'PO4': 'rho',
-            'Si': 'rho', 'FER': 'rho', 'O2': 'rho', 'TALK': 'rho',
-            'u': 'u', 'ubar': 'u', 'v': 'v', 'vbar': 'v'}
+    Returns a dictionary with an entry for each open boundary, e.g.
+    grid['south']['lon'], grid['south']['h'], etc. '''
 
-    gridType = gridType.get(variable)
+    OpenBoundaries = config.get('OpenBoundaries')
 
-    ''' Set variable offset, if any '''
+    grid = {}
+    with Dataset(config.get('grdname'), 'r') as nc:
+        for boundary, is_open in zip(BOUNDARIES, OpenBoundaries):
+            if not is_open:
+                continue
+
+            # Read the two outermost rows (or columns) of bathymetry
+            H = boundary_strip(nc.variables['h'], boundary)
+            if gridType == 'u':
+                H = .5 * (H[:,0:-1] + H[:,1::]) # Bathymetry at U points
+            elif gridType == 'v':
+                H = .5 * (H[0:-1,:] + H[1::,:]) # Bathymetry at V points
+
+            grid[boundary] = dict(
+                lon = boundary_edge(nc.variables['lon_' + gridType], boundary),
+                lat = boundary_edge(nc.variables['lat_' + gridType], boundary),
+                h = boundary_edge(H, boundary),
+                mask = boundary_edge(nc.variables['mask_' + gridType], boundary))
+
+    return grid
+
+def get_offset(config, variable):
+    ''' Set variable offset and units conversion factor, if any '''
     offset, factor = 0.0, 1.0
     if variable == 'temp':
         offset = float(config.get('tempOffset'))
@@ -172,174 +280,285 @@ def interpolate_bry_variable(config, variable):
     elif variable == 'TALK':
         factor = float(config.get('talkFactor'))
     # Similar feature could be extended for PISCES...
+    return offset, factor
+
+def cmems_files(config):
+    ''' Find the Copernicus file downloaded for each variable '''
+    files = {}
+    for f in sorted(glob.glob(config.get('cmemspath') + '/cmems-*-*.nc')):
+        variable = os.path.basename(f).split('-')[1]
+        files.setdefault(variable, f)
+    return files
+
+def read_cmems(config, variable, f):
+    ''' Read ocean variable and coordinates from Copernicus file F '''
 
-    ''' Read CROCO grid '''
-    with Dataset(config.get('grdname'), 'r') as nc:
-        # Read CROCO longitude
-        lon = nc.variables['lon_' + gridType][:]
-        # Read CROCO latitude
-        lat = nc.variables['lat_' + gridType][:]
-        #Read CROCO bathymetry
-        H = nc.variables['h'][:]
-        # Read CROCO land/sea mask
-        mask = nc.variables['mask_' + gridType][:]
-
-    # Get CROCO grid size
-    M, L = mask.shape
-        
-    if gridType == 'u':
-        H = .5 * (H[:,0:-1] + H[:,1::]) # Bathymetry at U points
-    elif gridType == 'v':
-        H = .5 * (H[0:-1,:] + H[1::,:]) # Bathymetry at V points
-
-    ''' Read from Copernicus '''
-    cmemspath = config.get('cmemspath')
-
-    f = glob.glob(cmemspath + f'/cmems-{variable}-*.nc')[0]
     # Get Copernicus variable name
     varname = config.get(variable)[2]
+
+    cmems = {}
     # Open Copernicus file
     with Dataset(f, 'r') as nc:
-        data = nc.variables[varname][:]
+        cmems['data'] = nc.variables[varname][:]
         # Get variable dimensions
         dimensions = nc.variables[varname].dimensions
 
         # Read coordinates
         for i in dimensions:
             if 'lon' in i:
-                longitude = nc.variables[i][:]
+                cmems['longitude'] = nc.variables[i][:]
             if 'lat' in i:
-                latitude = nc.variables[i][:]
+                cmems['latitude'] = nc.variables[i][:]
             if 'depth' in i:
-                depth = nc.variables[i][:]
+                cmems['depth'] = nc.variables[i][:]
             if 'time' in i:
-                time = num2date(nc.variables[i][:],
+                cmems['time'] = num2date(nc.variables[i][:],
                         nc.variables[i].units)
+    return cmems
+
+def interpolate_bry_variable(config, variable, cmems, grid, weights):
+    ''' Interpolate CROCO ocean variable for boundary forcing, where:
+
+    cmems: Copernicus data and coordinates, as returned by read_cmems.
+
+    grid: CROCO boundary geometry, as returned by read_boundary_grid.
+
+    weights: horizontal interpolation weights, as returned by get_weights.
+
+    Returns a dictionary with the boundary array for each open
+    boundary, ready to be written to the boundary forcing file. '''
+
+    gridType = GRIDTYPE.get(variable)
+
+    offset, factor = get_offset(config, variable)
+
+    data, time, depth = cmems['data'], cmems['time'], cmems.get('depth')
+
+    out = {} # Boundary arrays, ready to be written
+    for boundary, W in weights.items():
+        # Interpolate all time steps (and depth levels) to this boundary at once
+        bry = interpolate(W, data)
+
+        ''' 2-D variable processing '''
+        if 'zeta' in variable or 'bar' in variable:
+            bry = fill_mask(bry, variable)
+
+            if variable != config.get('master'):
+                bry = interp_time(config, time, bry)
+
+            out[boundary] = offset + bry * factor; continue
+
+        ''' 3-D variable processing '''
+        bry = fill_mask(bry, variable)
+
+        bry3d = vertical_interpolations(
+                get_vertical_weights(config, gridType, boundary, grid, depth), bry,
+                grid[boundary]['mask'], variable)
 
-    ''' 2-D variable processing '''
-    if 'zeta' in variable or 'bar' in variable: 
-        if OpenBoundaries[0]: # South
-            S = -10*np.ones((len(time), L))
-        if OpenBoundaries[1]: # East
-            E = -10*np.ones((len(time), M))
-        if OpenBoundaries[2]: # North
-            N = -10*np.ones((len(time), L))
-        if OpenBoundaries[3]: # West
-            W = -10*np.ones((len(time), M))
-
-        for i in range(len(time)):
-            data_i = data[i,:,:]
-
-            GridInterpolant = RegularGridInterpolator((latitude, 
-                longitude), data_i)
-
-            # Interpolate to CROCO grid
-            out = GridInterpolant((lat, lon))
-
-            if OpenBoundaries[0]: # South
-                S[i,:] = fill_mask(out[0,:], variable)
-            if OpenBoundaries[1]: # East
-                E[i,:]  = fill_mask(out[:,-1], variable)
-            if OpenBoundaries[2]: # North
-                N[i,:] = fill_mask(out[-1,:], variable)
-            if OpenBoundaries[3]: # West
-                W[i,:]  = fill_mask(out[:,0], variable) 
-
-        if variable != config.get('master'):
-            if OpenBoundaries[0]: # South
-                S = interp_time2d(config, time, S)
-            if OpenBoundaries[1]: # East
-                E = interp_time2d(config, time, E)
-            if OpenBoundaries[2]: # North
-                N = interp_time2d(config, time, N)
-            if OpenBoundaries[3]: # West
-                W = interp_time2d(config, time, W)
-
-
-        ''' Write to CROCO boundary forcing file '''
+        if ( variable != config.get('master') ) and ( variable not in PISCES ):
+            bry3d = interp_time(config, time, bry3d)
+
+        out[boundary] = offset + bry3d * factor
+
+    return out
+
+def stream_bry_variable(config, variable, f, grid, weights, nc):
+    ''' Memory-bounded version of interpolate_bry_variable. The Copernicus
+    file F is read one time chunk at a time, and only the lat/lon slab
+    around each open boundary is read. Each chunk is interpolated and
+    written straight into the boundary forcing file NC (already open).
+
+    The chunk length is set so that the working arrays stay within the
+    "brymemory" budget [MB] in the configuration file. '''
+
+    gridType = GRIDTYPE.get(variable)
+
+    offset, factor = get_offset(config, variable)
+
+    # Get Copernicus variable name
+    varname = config.get(variable)[2]
+
+    with Dataset(f, 'r') as cdf:
+        var = cdf.variables[varname]
+
+        # Read coordinates
+        depth = None
+        for i in var.dimensions:
+            if 'lon' in i:
+                L = len(cdf.variables[i])
+            if 'lat' in i:
+                M = len(cdf.variables[i])
+            if 'depth' in i:
+                depth = cdf.variables[i][:]
+            if 'time' in i:
+                time = num2date(cdf.variables[i][:],
+                        cdf.variables[i].units)
+        T, Z = len(time), 1 if depth is None else len(depth)
+
+        # Lat/lon slab and reduced interpolation matrix for each open boundary
+        slabs = {boundary: boundary_slab(W, M, L) for boundary, W in weights.items()}
+
+        if 'zeta' in variable or 'bar' in variable: # 2-D variable
+            interpolated = variable != config.get('master')
+        else: # 3-D variable
+            interpolated = ( variable != config.get('master') ) and ( variable not in PISCES )
+
+        if interpolated:
+            # Master time indices, grouped by the native record right before them
+            j = get_time_weights(config, time)['j']
+
+        ''' Set chunk length (in native time records) '''
+        N = int(config.get('N'))
+        size = 0
+        for boundary, (rows, columns, W) in slabs.items():
+            cells = (rows.stop - rows.start) * (columns.stop - columns.start)
+            # Slab as read from file (data and mask) plus interpolated boundary arrays
+            size += cells * Z * 5 + W.shape[0] * (Z + N) * 8 * 4
+        chunk = max(1, int(float(config.get('brymemory')) * 1024**2 // size) - 1)
+
+        for start in range(0, T, chunk):
+            end = min(start + chunk, T)
+
+            if interpolated:
+                # One extra record is needed to interpolate up to the end of the chunk
+                select = np.where((j >= start) & (j < end))[0]
+                if not select.size:
+                    continue
+                target, end = slice(select[0], select[-1] + 1), min(end + 1, T)
+            else:
+                target = slice(start, end)
+
+            for boundary, (rows, columns, W) in slabs.items():
+                # Read this time chunk, only around this boundary
+                data = var[(slice(start, end),) + (slice(None),) * (var.ndim - 3) + (rows, columns)]
+
+                bry = fill_mask(interpolate(W, data), variable)
+
+                if depth is not None: # 3-D variable
+                    bry = vertical_interpolations(
+                            get_vertical_weights(config, gridType, boundary, grid, depth), bry,
+                            grid[boundary]['mask'], variable)
+
+                if interpolated:
+                    bry = interp_time(config, time, bry, select=target, start=start)
+
+                nc.variables[variable + '_' + boundary][target] = offset + bry * factor
+
+def bry_worker(config, variable, f, grid, weights):
+    ''' Read and interpolate one variable from Copernicus file F.
+    This runs in a worker process in parallel mode. '''
+    cmems = read_cmems(config, variable, f)
+    return variable, interpolate_bry_variable(config, variable, cmems, grid, weights)
+
+def write_bry(nc, results):
+    ''' Write a group of interpolated variables to the open boundary
+    forcing file NC, and flush. RESULTS is a list of (variable, boundary
+    arrays) pairs, as returned by bry_worker. '''
+    for v, out in results:
+        for boundary, bry in out.items():
+            nc.variables[v + '_' + boundary][:] = bry
+    nc.sync()
+
+def bry_writer(bryname, queue):
+    ''' Single writer process. Write groups of interpolated variables
+    to the boundary forcing file BRYNAME as they arrive through QUEUE,
+    so that HDF5 file access stays single-writer. Stops on None. '''
+    with Dataset(bryname, 'a') as nc:
+        for results in iter(queue.get, None):
+            write_bry(nc, results)
+
+def make_bry_variables(config, variables):
+    ''' Boundary builder. Interpolate all VARIABLES to the CROCO
+    open boundaries and write them to the boundary forcing file.
+
+    The CROCO boundary geometry is read once for each grid type, and
+    variables are grouped by CMEMS dataset and grid type, so that
+    horizontal interpolation weights are only set up once per group.
+    The boundary forcing file is kept open for the whole build, and
+    each group is written in a single flush.
+
+    If "bryworkers" in the configuration file is larger than 1, the
+    variables are interpolated in parallel by a pool of worker processes,
+    while a dedicated process writes the results. Groups are written in
+    the same order as in serial mode, so the output file is identical. 
+    
+    If "brymemory" is set in the configuration file, variables are
+    streamed in time chunks instead (see stream_bry_variable). '''
+
+    files = cmems_files(config)
+
+    # Group variables by CMEMS dataset and grid type
+    groups = {}
+    for v in variables:
+        groups.setdefault((config.get(v)[1], GRIDTYPE.get(v)), []).append(v)
+
+    ''' Set up boundary geometry and horizontal interpolation weights '''
+    grids, weights, tasks = {}, {}, []
+    for (dataset, gridType), group in groups.items():
+        # Read CROCO grid along the open boundaries only (once per grid type)
+        if gridType not in grids:
+            grids[gridType] = read_boundary_grid(config, gridType)
+        grid = grids[gridType]
+
+        task = []
+        for v in group:
+            with Dataset(files[v], 'r') as nc:
+                latitude = nc.variables['latitude'][:]
+                longitude = nc.variables['longitude'][:]
+
+            # Get horizontal interpolation weights (read from cache if available)
+            key = (gridType, latitude.tobytes(), longitude.tobytes())
+            if key not in weights:
+                weights[key] = get_weights(config, gridType, latitude, longitude, grid)
+
+            task.append((v, files[v], grid, weights[key]))
+        tasks.append((dataset, gridType, task))
+
+    workers = int(config.get('bryworkers', 1))
+
+    if config.get('brymemory'):
+        ''' Streaming mode. Variables are processed one after another '''
+        logger.info(f'{now()} Processing boundary variables within {config.get("brymemory")} MB')
         with Dataset(config.get('bryname'), 'a') as nc:
-            if OpenBoundaries[0]: # South
-                nc.variables[variable + '_south'][:] = offset + S * factor
-            if OpenBoundaries[1]: # East
-                nc.variables[variable + '_east'][:] = offset + E * factor
-            if OpenBoundaries[2]: # North
-                nc.variables[variable + '_north'][:] = offset + N * factor
-            if OpenBoundaries[3]: # West
-                nc.variables[variable + '_west'][:] = offset + W * factor
+            for dataset, gridType, task in tasks:
+                logger.info(f'{now()} Processing DATASET-{dataset} at {gridType} points')
+                for v, f, grid, W in task:
+                    logger.info(f'{now()} Processing variable {v}')
+                    stream_bry_variable(config, v, f, grid, W, nc)
+                nc.sync()
+        return
 
+    if workers <= 1:
+        ''' Serial mode '''
+        with Dataset(config.get('bryname'), 'a') as nc:
+            for dataset, gridType, task in tasks:
+                logger.info(f'{now()} Processing DATASET-{dataset} at {gridType} points')
+                results = []
+                for v, f, grid, W in task:
+                    logger.info(f'{now()} Processing variable {v}')
+                    results.append(bry_worker(config, v, f, grid, W))
+                write_bry(nc, results)
         return
 
-    ''' 3-D variable processing '''
-    # Output initialization
-    if OpenBoundaries[0]: # South
-        S3D = -10*np.ones((len(time), int(config.get('N')), L))
-    if OpenBoundaries[1]: # East
-        E3D = -10*np.ones((len(time), int(config.get('N')), M))
-    if OpenBoundaries[2]: # North
-        N3D = -10*np.ones((len(time), int(config.get('N')), L))
-    if OpenBoundaries[3]: # West
-        W3D = -10*np.ones((len(time), int(config.get('N')), M))
-    
-    for t in range(len(time)):
-        if OpenBoundaries[0]: # South
-            S = -10*np.ones((len(depth), L))
-        if OpenBoundaries[1]: # East
-            E = -10*np.ones((len(depth), M))
-        if OpenBoundaries[2]: # North
-            N = -10*np.ones((len(depth), L))
-        if OpenBoundaries[3]: # West
-            W = -10*np.ones((len(depth), M))
-
-        for k in range(len(depth)):
-            data_i = data[t,k,:,:]
-
-            GridInterpolant = RegularGridInterpolator((latitude, 
-                longitude), data_i)
-
-            # Interpolate to CROCO grid
-            out = GridInterpolant((lat, lon))
-
-            if OpenBoundaries[0]: # South
-                S[k,:] = fill_mask(out[0,:], variable) 
-            if OpenBoundaries[1]: # East
-                E[k,:]  = fill_mask(out[:,-1], variable)
-            if OpenBoundaries[2]: # North
-                N[k,:] = fill_mask(out[-1,:], variable)
-            if OpenBoundaries[3]: # West
-                W[k,:]  = fill_mask(out[:,0], variable) 
-
-        if OpenBoundaries[0]:
-            S3D[t,:,:] = vertical_interpolations(config, H[0,:], 
-                    depth, S, mask[0,:], variable)
-        if OpenBoundaries[1]:
-            E3D[t,:,:] = vertical_interpolations(config, H[:,-1], 
-                    depth, E, mask[:,-1], variable)
-        if OpenBoundaries[2]:
-            N3D[t,:,:] = vertical_interpolations(config, H[-1,:], 
-                    depth, N, mask[-1,:], variable)
-        if OpenBoundaries[3]: 
-            W3D[t,:,:] = vertical_interpolations(config, H[:,0], 
-                    depth, W, mask[:,0], variable)
-
-    if ( variable != config.get('master') ) and ( variable not in PISCES ):
-        if OpenBoundaries[0]: # South
-            S3D = interp_time3d(config, time, S3D)
-        if OpenBoundaries[1]: # East
-            E3D = interp_time3d(config, time, E3D)
-        if OpenBoundaries[2]: # North
-            N3D = interp_time3d(config, time, N3D)
-        if OpenBoundaries[3]: # West
-            W3D = interp_time3d(config, time, W3D)
-
-    ''' Write to CROCO boundary forcing file '''
-    with Dataset(config.get('bryname'), 'a') as nc:
-        if OpenBoundaries[0]: # South
-            nc.variables[variable + '_south'][:] = offset + S3D * factor
-        if OpenBoundaries[1]: # East
-            nc.variables[variable + '_east'][:] = offset + E3D * factor
-        if OpenBoundaries[2]: # North
-            nc.variables[variable + '_north'][:] = offset + N3D * factor
-        if OpenBoundaries[3]: # West
-            nc.variables[variable + '_west'][:] = offset + W3D * factor
-
-    return
+    ''' Parallel mode '''
+    logger.info(f'{now()} Processing boundary variables with {workers} workers')
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    writer = context.Process(target=bry_writer, args=(config.get('bryname'), queue))
+    writer.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [[pool.submit(bry_worker, config, v, f, grid, W)
+                for v, f, grid, W in task] for dataset, gridType, task in tasks]
+
+            # Send results to the writer in the same order as in serial mode
+            for (dataset, gridType, task), group in zip(tasks, futures):
+                results = [future.result() for future in group]
+                logger.info(f'{now()} Processed DATASET-{dataset} at {gridType} points: '
+                        + ', '.join(v for v, out in results))
+                queue.put(results)
+    finally:
+        queue.put(None); writer.join()
+
+    if writer.exitcode != 0:
+        raise RuntimeError(f'Boundary writer process failed with exit code {writer.exitcode}')
@@ -0,0 +1,148 @@
+from scipy.sparse import csr_matrix, save_npz, load_npz
+import numpy as np
+import hashlib
+import os
+
+BOUNDARIES = ('south', 'east', 'north', 'west')
+
+def boundary_edge(array, boundary):
+    ''' Extract the edge of a 2-D CROCO array (eta, xi)
+    corresponding to the selected open boundary '''
+    if boundary == 'south':
+        return array[0, :]
+    elif boundary == 'east':
+        return array[:, -1]
+    elif boundary == 'north':
+        return array[-1, :]
+    elif boundary == 'west':
+        return array[:, 0]
+    raise ValueError(f'Unknown boundary {boundary}')
+
+def boundary_strip(array, boundary):
+    ''' Extract the two outermost rows (or columns) of a 2-D CROCO
+    array (eta, xi) next to the selected open boundary. This is used
+    to average the bathymetry at U and V points along the boundary. '''
+    if boundary == 'south':
+        return array[0:2, :]
+    elif boundary == 'east':
+        return array[:, -2::]
+    elif boundary == 'north':
+        return array[-2::, :]
+    elif boundary == 'west':
+        return array[:, 0:2]
+    raise ValueError(f'Unknown boundary {boundary}')
+
+def grid_key(grdname, latitude, longitude):
+    ''' Hash of the CROCO grid file and the CMEMS longitude
+    and latitude axes. Interpolation weights are only valid
+    as long as neither of these changes. '''
+
+    sha = hashlib.sha1()
+    with open(grdname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    sha.update(np.ascontiguousarray(latitude, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(longitude, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+def find_cells(axis, points):
+    ''' Find the lower index of the CMEMS cell containing each point
+    and the normalized distance to that index. This follows the
+    same convention as scipy's RegularGridInterpolator. '''
+
+    axis = np.asarray(axis, dtype=np.float64)
+
+    if np.any(points < axis[0]) or np.any(points > axis[-1]):
+        raise ValueError('CROCO boundary is out of bounds of the CMEMS grid')
+
+    i = np.clip(np.searchsorted(axis, points) - 1, 0, len(axis) - 2)
+    return i, (points - axis[i]) / (axis[i+1] - axis[i])
+
+def bilinear_weights(latitude, longitude, lat, lon):
+    ''' Build a sparse matrix (n x M*L) that bilinearly interpolates
+    a CMEMS field on a regular (latitude, longitude) grid to the n
+    CROCO points given by (lat, lon), where:
+
+    latitude: CMEMS latitude (M x 1) 1-D array
+
+    longitude: CMEMS longitude (L x 1) 1-D array
+
+    lat, lon: CROCO coordinates (n x 1) 1-D arrays
+
+    Multiplying this matrix by a CMEMS field flattened in (latitude,
+    longitude) order gives the same result as RegularGridInterpolator. '''
+
+    lat = np.asarray(lat, dtype=np.float64).ravel()
+    lon = np.asarray(lon, dtype=np.float64).ravel()
+
+    M, L, n = len(latitude), len(longitude), len(lat)
+
+    j, y = find_cells(latitude, lat)
+    i, x = find_cells(longitude, lon)
+
+    # Each CROCO point takes contributions from the four corners of its cell
+    rows = np.repeat(np.arange(n), 4)
+    cols = np.stack((j*L + i, j*L + i + 1, (j+1)*L + i, (j+1)*L + i + 1), axis=1).ravel()
+    vals = np.stack(((1-y)*(1-x), (1-y)*x, y*(1-x), y*x), axis=1).ravel()
+
+    return csr_matrix((vals, (rows, cols)), shape=(n, M*L))
+
+def get_weights(config, gridType, latitude, longitude, grid):
+    ''' Return a dictionary with the sparse bilinear interpolation matrix
+    for each open boundary of the selected CROCO grid type ('rho', 'u', 'v').
+    GRID is the boundary geometry, as returned by read_boundary_grid.
+
+    If "weightspath" is set in the configuration file, weights are saved
+    to (and read back from) this directory. File names include a hash of
+    the CROCO grid and the CMEMS axes, so that daily runs reuse them. '''
+
+    path = config.get('weightspath')
+    if path:
+        key = grid_key(config.get('grdname'), latitude, longitude)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    weights = {}
+    for boundary, points in grid.items():
+        if path:
+            filename = f'{path}/weights-{gridType}-{boundary}-{key}.npz'
+            if os.path.isfile(filename):
+                weights[boundary] = load_npz(filename).tocsr(); continue
+
+        weights[boundary] = bilinear_weights(latitude, longitude,
+                points['lat'], points['lon'])
+
+        if path:
+            # Write to a temporary file first, so that concurrent runs never read half a file
+            tmp = f'{filename}.{os.getpid()}.npz'
+            save_npz(tmp, weights[boundary])
+            os.replace(tmp, filename)
+
+    return weights
+
+def interpolate(W, data):
+    ''' Apply interpolation matrix W (n x M*L) to every 2-D slice
+    of a CMEMS array (..., M, L) in a single matrix multiplication.
+    Returns an (..., n) array. '''
+
+    data = np.ma.getdata(data) # Land cells keep their fill value, as before
+    shape = data.shape[:-2]
+    out = W @ data.reshape(-1, data.shape[-2] * data.shape[-1]).T
+    return out.T.reshape(shape + (W.shape[0],))
+
+def boundary_slab(W, M, L):
+    ''' Find the smallest CMEMS lat/lon window (slab) used by the
+    interpolation matrix W (n x M*L), so that only this part of the
+    CMEMS grid needs to be read from file. Returns the latitude and
+    longitude index slices of the slab and the interpolation matrix
+    restricted to the slab cells. '''
+
+    cols = W.tocoo().col
+    j, i = cols // L, cols % L
+    rows, columns = slice(j.min(), j.max() + 1), slice(i.min(), i.max() + 1)
+
+    # Index of slab cells in the full CMEMS grid, in (latitude, longitude) order
+    cells = (np.arange(rows.start, rows.stop)[:, None] * L
+            + np.arange(columns.start, columns.stop)[None, :]).ravel()
+
+    return rows, columns, W[:, cells].tocsr()
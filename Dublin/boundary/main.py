@@ -1,10 +1,13 @@
+from copernicus_cache import copy_cmems, cached_download, clean_cache
 from create_boundary_file import create_bry
-from interpolate_boundary import interpolate_bry_variable 
+from interpolate_boundary import make_bry_variables
 from total_alkalinity import total_alkalinity
 from netCDF4 import Dataset, num2date, date2num
 from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 from log import set_logger, now
 import copernicusmarine
+import multiprocessing
 import numpy as np
 import traceback
 import glob
@@ -38,14 +41,17 @@ def get_boundaries(config):
         vals.append(float(config.get(k)))
     return vals
 
+def get_today(config):
+    ''' Use today as current date, unless selected otherwise '''
+    try:
+        return datetime.strptime(config.get('mydate'), '%Y%m%d').date()
+    except ValueError:
+        return date.today()
+
 def get_dates(config):
     ''' Get dates to process '''
 
-    # Use today as current date, unless selected otherwise
-    try:
-        today = datetime.strptime(config.get('mydate'), '%Y%m%d')
-    except ValueError:
-        today = date.today()
+    today = get_today(config)
 
     # Get start date to download
     idate = today - timedelta(days=int(config.get('days-back')))
@@ -68,8 +74,25 @@ def add_offset(filename, offset):
         # Add offset and write into NetCDF
         var[:] = date2num(time + timedelta(hours=offset), units)
        
-def copernicus_download(config, dataset, filename, variable, idate, edate):
-    ''' Download ocean variable from Copernicus dataset ''' 
+def product_time(dataset):
+    ''' Time of the last update of Copernicus DATASET, as reported by the
+    Copernicus Marine catalogue. None if it cannot be found. '''
+
+    try:
+        catalogue = copernicusmarine.describe(dataset_id=dataset, disable_progress_bar=True)
+        times = [part.arco_updated_date for product in catalogue.products
+                for d in product.datasets for version in d.versions
+                for part in version.parts if part.arco_updated_date]
+        # Use naive UTC times, as in the rest of the cache
+        return max(datetime.fromisoformat(str(t).replace('Z', '+00:00')).replace(tzinfo=None,
+            microsecond=0) for t in times) if times else None
+    except Exception as e:
+        logger.warning(f'{now()} Update time of {dataset} not available: {e}')
+        return None
+
+def copernicus_download(config, dataset, filename, variables, idate, edate):
+    ''' Download ocean variables from Copernicus dataset. VARIABLES is
+    the list of CMEMS variable names, which are all downloaded at once '''
 
     # Get geographical boundaries
     west, east, south, north = get_boundaries(config)
@@ -81,103 +104,131 @@ def copernicus_download(config, dataset, filename, variable, idate, edate):
             dataset_id=dataset,
             output_directory=config.get('cmemspath'),
             output_filename=filename,
-            variables=[variable],
+            variables=list(variables),
             minimum_longitude=west, maximum_longitude=east,
             minimum_latitude=south, maximum_latitude=north,
-            start_datetime=idate.strftime('%Y-%m-%dT00:00:00'),
-            end_datetime=edate.strftime('%Y-%m-%dT00:00:00')
+            start_datetime=idate.strftime('%Y-%m-%dT%H:%M:%S'),
+            end_datetime=edate.strftime('%Y-%m-%dT%H:%M:%S')
             )
 
+def split_copernicus(f, files):
+    ''' Split a multi-variable NetCDF downloaded from CMEMS "f" into
+    one file per variable. FILES maps each output file name (absolute
+    path) to the CMEMS variable name to be copied into it. Dimensions,
+    coordinates and attributes are copied unchanged. '''
+
+    with Dataset(f, 'r') as src:
+        for filename, cdfvar in files.items():
+            copy_cmems(src, filename, cdfvar, skip=files.values())
+
+def copernicus_dataset(config, dataset, offset, selections, idate, idatestr, edate, edatestr):
+    ''' Download all the variables needed from a Copernicus dataset in a
+    single request. Then, split them into the per-variable files expected
+    downstream (cmems-{v}-{idatestr}-{edatestr}.nc). SELECTIONS is a list
+    of (variable, user's choices in config) for this dataset.
+
+    If "cmemscache" is set in the configuration file, only the days missing
+    from the local cache are downloaded, and the per-variable files are
+    assembled from the cache instead. '''
+
+    localpath = config.get('cmemspath')
+
+    cdfvars = [selection[2] for v, selection in selections]
+    files = {f'{localpath}/cmems-{v}-{idatestr}-{edatestr}.nc': selection[2]
+            for v, selection in selections}
+
+    if config.get('cmemscache'):
+        # Download missing days only, then assemble per-variable files from cache
+        download = lambda filename, variables, start, end: copernicus_download(
+                config, dataset, filename, variables, start, end)
+        cached_download(config, download, dataset, cdfvars, files, idate, edate,
+                get_today(config), product_time(dataset))
+    else:
+        # Download all variables at once
+        filename = f'{dataset}-{idatestr}-{edatestr}.nc'
+        copernicus_download(config, dataset, filename, cdfvars, idate, edate)
+
+        # Split into one file per variable
+        split_copernicus(f'{localpath}/{filename}', files)
+        os.remove(f'{localpath}/{filename}')
+
+    for (v, selection), f in zip(selections, files):
+        if selection[3] == 'T':
+            # For this parameter, extend NetCDF to cover the full of the FC period
+            extend_copernicus(f, idate, edate, selection[2])
+
+        # Add offset time, in hours, to NetCDF time array
+        add_offset(f, float(offset))
+
+def nearest_records(nctime, timeList):
+    ''' Index of the nearest record in NCTIME for each day in TIMELIST
+    (both sorted arrays of datetimes). Ties go to the earliest record. '''
+
+    src = np.array(nctime, dtype='datetime64[D]')
+    tgt = np.array(timeList, dtype='datetime64[D]')
+    if len(src) == 1:
+        return np.zeros(len(tgt), dtype=int)
+
+    # Records right before and after each day
+    i = np.clip(np.searchsorted(src, tgt), 1, len(src) - 1)
+    return np.where(tgt - src[i - 1] <= src[i] - tgt, i - 1, i)
+
 def extend_copernicus(f, idate, edate, cdfvar):
     ''' Given a NetCDF file downloaded from CMEMS "f" (absolute path mandatory),
-    this function creates an identifical file with the same name (overwrites
-    existing file), except that the time dimension is extended to cover the 
-    period from IDATE to EDATE (both Python datetime objects). CDFVAR is the
-    name of the data variable in the file (e.g. "dissic", "no3", "thetao", etc.)
-    
+    this function extends the time dimension to cover the period from IDATE
+    to EDATE (both Python datetime objects), with one record per day. CDFVAR
+    is the name of the data variable in the file (e.g. "dissic", "no3", etc.)
+
     When the selected time range (IDATE to EDATE) is outside the existing in the
     original NetCDF, it uses the closest data in time to write the data array.
-    
-    This function is needed to extend biogeochemistry files in CMEMS, which do 
+
+    This function is needed to extend biogeochemistry files in CMEMS, which do
     not cover the full length of the forecast in certain days of the week. As
-    a result of this script, an identical NetCDF is created, but with trailing,
-    repeated values at the end of the period. '''                                                           
+    a result of this script, the NetCDF gets trailing, repeated values at the
+    end of the period.
+
+    In the usual case, where the file already has the first days of the
+    period, only the missing records are appended to the (unlimited) time
+    dimension. Otherwise, the file is rewritten with the nearest record
+    for each day. Data are copied raw, with their original type and
+    attributes. '''
 
     idate = datetime.combine(idate, datetime.min.time()) # Datetime required
     edate = datetime.combine(edate, datetime.min.time()) # Datetime required
 
     ''' Create new time array, from IDATE to EDATE '''
-    timeList = []
-    while idate <= edate:
-        timeList.append(idate)
-        idate += timedelta(days=1)
-    T = len(timeList); timeList = np.array(timeList)
-    
-    ''' Read file as downloaded from CMEMS '''
-    with Dataset(f, 'r') as nc:
-        # Read depth
-        depth = nc.variables['depth'][:]
-        # Read latitude
-        latitude = nc.variables['latitude'][:]
-        # Read longitude
-        longitude = nc.variables['longitude'][:]
+    T = (edate - idate).days + 1
+    timeList = np.array([idate + timedelta(days=i) for i in range(T)])
+
+    with Dataset(f, 'a') as nc:
+        nc.set_auto_maskandscale(False)
         # Read time
-        time = nc.variables['time'][:]
-        offset = nc.variables['time'].units
-        nctime = num2date(time, offset)
+        tvar = nc.variables['time']
+        nctime = num2date(tvar[:], tvar.units)
         nctime = np.array([datetime(i.year, i.month, i.day) for i in nctime])
-        # Read variable
-        standard_name = nc.variables[cdfvar].standard_name
-        units = nc.variables[cdfvar].units
-        data = nc.variables[cdfvar][:]
-
-    if np.array_equal(timeList, nctime):
-        return # Time is already as desired. Nothing else needed. Exit
-            
-    logger.info(f' '); logger.info(f'{now()} Applying time extension to {cdfvar}'); logger.info(f' ')
-
-    # Get dimensions
-    _, N, M, L = data.shape
-    
-    ''' Create output data array '''
-    out = np.empty((T, N, M, L))
-    # Loop along time to fill output array
-    for index, date_i in enumerate(timeList):   
-        # Find nearest index
-        w = np.argmin(abs(nctime-date_i))
-        # Write into output array    
-        out[index, :, :, :] = data[w, :, :, :]
-        
-    ''' Create new NetCDF '''
-    if os.path.isfile(f):
-        os.remove(f)
-    
-    with Dataset(f, 'w', format='NETCDF4') as nc:
-        nc.createDimension('depth', N)
-        nc.createDimension('latitude', M)
-        nc.createDimension('longitude', L)
-        nc.createDimension('time', T) 
-        
-        z = nc.createVariable('depth', 'f4', dimensions=('depth',))
-        z.standard_name = 'depth'; z.units = 'm'; z[:] = depth
-        
-        latvar = nc.createVariable('latitude', 'f8', dimensions=('latitude'))
-        latvar.standard_name = 'latitude'; latvar.units = 'degrees_north'
-        latvar[:] = latitude
-        
-        lonvar = nc.createVariable('longitude', 'f8', dimensions=('longitude'))
-        lonvar.standard_name = 'longitude'; latvar.units = 'degrees_east'
-        lonvar[:] = longitude
-        
-        tvar = nc.createVariable('time', 'f4', dimensions=('time'))
-        tvar.standard_name = 'time'; tvar.units = offset
-        tvar[:] = date2num(timeList, offset)
-        
-        datavar = nc.createVariable(cdfvar, 'f8', 
-            dimensions=('time', 'depth', 'latitude', 'longitude'))
-        datavar.standard_name = standard_name
-        datavar.units = units
-        datavar[:] = out
+
+        if np.array_equal(timeList, nctime):
+            return # Time is already as desired. Nothing else needed. Exit
+
+        logger.info(f' '); logger.info(f'{now()} Applying time extension to {cdfvar}'); logger.info(f' ')
+
+        n = len(nctime)
+        if 0 < n < T and nc.dimensions['time'].isunlimited() \
+                and np.array_equal(timeList[:n], nctime):
+            ''' Append the missing days, repeating the last record '''
+            var = nc.variables[cdfvar]
+            var[n:T] = np.broadcast_to(var[n-1], (T - n,) + var.shape[1:])
+            tvar[:] = date2num(timeList, tvar.units)
+            return
+
+    ''' Rewrite NetCDF with the nearest record for each day '''
+    with Dataset(f, 'r') as nc:
+        copy_cmems(nc, f + '.tmp', cdfvar, records=nearest_records(nctime, timeList))
+    os.replace(f + '.tmp', f)
+
+    with Dataset(f, 'a') as nc:
+        tvar = nc.variables['time']
+        tvar[:] = date2num(timeList, tvar.units)
 
 def copernicus():
     ''' Download Copernicus datasets for boundary forcing '''
@@ -196,9 +247,15 @@ def copernicus():
     for f in files:
         os.remove(f)
 
+    if config.get('cmemscache'):
+        # Remove cached days that are no longer needed
+        clean_cache(config, idate)
+
     variables = ('zeta', 'u', 'v', 'ubar', 'vbar', 'temp', 'salt',
             'DIC', 'NO3', 'PO4', 'Si', 'O2', 'FER', 'NH4', 'pH')
 
+    # Group variables by Copernicus dataset, so that each dataset is downloaded once
+    datasets = {}
     for v in variables:
         if v in PISCES and config.get('PISCES') != 'T':
             continue # Ignore PISCES 
@@ -216,21 +273,18 @@ def copernicus():
             except ValueError:
                 logger.error(f'{now()} Time offset for {v} not specified for dataset'); continue
 
-            cdfvar = selection[2] # CMEMS ocean variable name
-            
-            # Set file name to download from Copernicus
-            filename = f'cmems-{v}-{idatestr}-{edatestr}.nc'
-
-            # Download using Copernicus Marine API
-            copernicus_download(config, dataset, filename, cdfvar, idate, edate)
+            datasets.setdefault((dataset, offset), []).append((v, selection))
 
-            if selection[3] == 'T':
-                # For this parameter, extend NetCDF to cover the full of the FC period
-                extend_copernicus(config.get('cmemspath') + '/' + filename,
-                        idate, edate, cdfvar)
-
-            # Add offset time, in hours, to NetCDF time array 
-            add_offset(config.get('cmemspath') + '/' + filename, float(offset))
+    # Download datasets concurrently. Use processes, not threads: both the
+    # Copernicus client and the post-processing below write NetCDF files, 
+    # and the HDF5 library is not thread-safe
+    workers = int(config.get('cmemsworkers', 1))
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(copernicus_dataset, config, dataset, offset, selections,
+            idate, idatestr, edate, edatestr) for (dataset, offset), selections in datasets.items()]
+        for future in futures:
+            future.result() # Raise any exception from the download processes
 
     if config.get('PISCES') == 'T': # PISCES selected
         total_alkalinity(config, idatestr, edatestr) # Calculate total alkalinity
@@ -287,11 +341,7 @@ def make_boundary():
 
                 break 
 
-    # Use today as current date, unless selected otherwise
-    try:
-        today = datetime.strptime(config.get('mydate'), '%Y%m%d')
-    except ValueError:
-        today = date.today()
+    today = get_today(config)
 
     # Remove NetCDF files older than 2 days
     clean(config.get('hindpath') + '/', 2)
@@ -307,16 +357,19 @@ def make_boundary():
 
     variables = ('zeta', 'u', 'v', 'ubar', 'vbar', 'temp', 'salt',
             'DIC', 'TALK', 'NO3', 'PO4', 'Si', 'O2', 'FER', 'NH4')
+    selected = []
     for v in variables:
         if v in PISCES and config.get('PISCES') != 'T':
             continue # Ignore PISCES 
         selection = config.get(v) # Get user's choices for this variable
         if selection[0] == 'Y': # 'Yes', generate boundary forcing for this variable
-            logger.info(f'{now()} Processing variable {v}')
-            interpolate_bry_variable(config, v)
+            selected.append(v)
+
+    # Interpolate all variables and write them to the boundary forcing file
+    make_bry_variables(config, selected)
 
     # Write name of boundary file to copy to HPC
-    with open('/log/boundary.config', 'w') as f:
+    with open(config.get('brylog', '/log/boundary.config'), 'w') as f:
         f.write(f'bryname={os.path.abspath(config.get("bryname"))}')
                 
 def clean(path, D):
@@ -1,28 +1,49 @@
+from functools import lru_cache
 import numpy as np
 
-def scoord2z(point_type, zeta, topo, theta_s, theta_b, N, hc, scoord='new2008', Dcrit=0.2):
+# CROCO vertical transformation equation (Vtransform) to S-coordinate type
+SCOORD = {1: 'old1994', 2: 'new2008'}
+
+@lru_cache(maxsize=None)
+def s_levels(point_type, N):
     '''
-    scoord2z finds z at either rho or w points (positive up, zero at rest surface)
+    s_levels returns the sigma coordinate at either rho or w points
+
+    Inputs:
+      point_type        'r' or 'w'
+      N                 number of vertical rho-points
+
+    Outputs:
+      sc                sigma coordinate (read-only, cached)
+    '''
+    N = np.float64(N)
+    if 'w' in point_type:
+        sc = (np.arange(N+1,dtype=np.float64)-N)/N
+    else:
+        sc = ((np.arange(1,N+1,dtype=np.float64))-N-0.5)/N
+    sc.setflags(write=False)
+    return sc
+
+@lru_cache(maxsize=None)
+def stretching(point_type, theta_s, theta_b, N, scoord='new2008'):
+    '''
+    stretching returns the S-coordinate stretching curve at either rho or w
+    points. Results are cached, since they only depend on these parameters.
 
     Inputs:
       point_type        'r' or 'w'
-      zeta               sea surface height
-      topo              array of depths (e.g., from grd file)
       theta_s           surface focusing parameter
       theta_b           bottom focusing parameter
       N                 number of vertical rho-points
-      hc                critical depth
       scoord            'new2008' :new scoord 2008  or 'old1994' for Song scoord
-    
+
     Outputs:
-      z                 depth
-      Cs                Cs parameter
-      sc                sigma coordinate
+      Cs                Cs parameter (read-only, cached)
     '''
-    def CSF(sc,theta_s,theta_b):
-        '''
-        Allows use of theta_b > 0 (July 2009)
-        '''
+    sc = s_levels(point_type, N)
+
+    if scoord == 'new2008':
+        # Allows use of theta_b > 0 (July 2009)
         one64 = np.float64(1)
         if theta_s > 0.:
             csrf = ((one64-np.cosh(theta_s*sc))
@@ -35,77 +56,74 @@ def scoord2z(point_type, zeta, topo, theta_s, theta_b, N, hc, scoord='new2008',
                 /(np.exp(theta_b)-one64)-one64)
         else:
             Cs = csrf
-        return Cs
-
-    N = np.float64(N)
-    if isinstance(zeta,float):
-        zeta = np.ones(topo.shape)*zeta
-    if scoord not in 'new2008':
+    elif scoord == 'old1994':
         cff1 = 1./np.sinh(theta_s)
         cff2 = 0.5/np.tanh(0.5*theta_s)
-    sc_w = (np.arange(N+1,dtype=np.float64)-N)/N
-    sc_r = ((np.arange(1,N+1,dtype=np.float64))-N-0.5)/N
-
-    if 'w' in point_type:
-        sc = sc_w
-        N += 1. # add a level
-    else:
-        sc = sc_r
-        
-    if len(np.array(zeta).shape)>2: # case zeta is 3-D (in time)
-        z  = np.empty((int(zeta.shape[0]),) + (int(N),) + topo.shape, dtype=np.float64)
-    else:
-        z  = np.empty((int(N),) + topo.shape, dtype=np.float64)
-
-    if scoord in 'new2008':
-        Cs = CSF(sc,theta_s,theta_b)
-    elif scoord in 'old1994':
         Cs = (1.-theta_b)*cff1*np.sinh(theta_s*sc)+ \
            theta_b*(cff2*np.tanh(theta_s*(sc+0.5))-0.5)
+    else:
+        raise Exception("Unknown scoord, should be 'new2008' or 'old1994'")
+
+    Cs.setflags(write=False)
+    return Cs
+
+def scoord2z(point_type, zeta, topo, theta_s, theta_b, N, hc, scoord='new2008', Dcrit=0.2):
+    '''
+    scoord2z finds z at either rho or w points (positive up, zero at rest surface)
+
+    Inputs:
+      point_type        'r' or 'w'
+      zeta              sea surface height. Either a number, an array with
+                        the same shape as topo, or an array with a leading
+                        time dimension (time-varying sea level)
+      topo              array of depths (e.g., from grd file)
+      theta_s           surface focusing parameter
+      theta_b           bottom focusing parameter
+      N                 number of vertical rho-points
+      hc                critical depth
+      scoord            'new2008' :new scoord 2008  or 'old1994' for Song scoord
+
+    Outputs:
+      z                 depth, with shape ([time,] level, topo.shape...)
+      Cs                Cs parameter
+      sc                sigma coordinate
+
+    All levels (and times) are computed at once. Inputs are not modified.
+    '''
+    sc = s_levels(point_type, int(N))
+    Cs = stretching(point_type, float(theta_s), float(theta_b), int(N), scoord)
+
+    topo = np.asarray(topo)
+    zeta = np.asarray(zeta)
+
+    # Broadcast S-levels against the horizontal dimensions
+    levels = (-1,) + (1,)*topo.ndim
+    if zeta.ndim > topo.ndim: # case zeta is 3-D (in time)
+        zeta = zeta[:, np.newaxis]
+
+    if scoord == 'new2008':
+        # Minimum water depth
+        zeta = np.maximum(zeta, Dcrit-topo)
 
-    if scoord in 'new2008':
         hinv = 1. / (abs(topo) + hc)
-        cff = hc * sc
-        cff1 = Cs
-            
-        if len(np.array(zeta).shape)>2:
-            for t in range(zeta.shape[0]):
-                zeta[t][zeta[t]<(Dcrit-topo)] = Dcrit-topo[zeta[t]<(Dcrit-topo)]
-                if 'w' in point_type:
-                    z[t,0] = -topo
-                    start = 1
-                else:
-                    start = 0
-                for k in np.arange(start,N, dtype=int):
-                    z[t,k] = zeta[t]+(zeta[t]+topo)* \
-                             (cff[k]+cff1[k]*abs(topo))*hinv
-        else:
-            zeta[zeta<(Dcrit-topo)] = Dcrit-topo[zeta<(Dcrit-topo)]
-            for k in np.arange(N, dtype=int):
-                z[k] = zeta+(zeta+topo)* \
-                       (cff[k]+cff1[k]*abs(topo))*hinv
+        cff = (hc * sc).reshape(levels)
+        cff1 = Cs.reshape(levels)
+
+        z = zeta+(zeta+topo)* \
+            (cff+cff1*abs(topo))*hinv
+        if 'w' in point_type and zeta.ndim > topo.ndim:
+            z[:,0] = -topo
+
+    else: # 'old1994'
+        topo = np.where(topo==0, 1.e-2, topo)
+        # Minimum water depth
+        zeta = np.maximum(zeta, Dcrit-topo)
 
-    elif scoord in 'old1994':
-        topo[topo==0] = 1.e-2
         hinv = 1./topo
-        cff = hc*(sc-Cs)
-        cff1 = Cs
-        cff2 = sc + 1
-
-        if len(np.array(zeta).shape)>2:
-            for t in range(zeta.shape[0]):
-                zeta[t][zeta[t]<(Dcrit-topo)] = Dcrit-topo[zeta[t]<(Dcrit-topo)]
-                for k in np.arange(N,dtype=int) + 1:
-                    z0 = cff[k-1]+cff1[k-1]*topo
-                    z[t,k-1, :] = z0+zeta[t,:]*(1.+z0*hinv)
-        else:
-            zeta[zeta<(Dcrit-topo)] = Dcrit-topo[zeta<(Dcrit-topo)]
-            for k in np.arange(N,dtype=int) + 1:
-                z0 = cff[k-1]+cff1[k-1]*topo
-                z[k-1, :] = z0+zeta*(1.+z0*hinv)
-    else:
-        raise Exception("Unknown scoord, should be 'new2008' or 'old1994'")
+        cff = (hc*(sc-Cs)).reshape(levels)
+        cff1 = Cs.reshape(levels)
+
+        z0 = cff+cff1*topo
+        z = z0+zeta*(1.+z0*hinv)
 
-    if sc_r is None:
-        sc_r = sc_r
-    return z.squeeze(), np.float32(Cs), sc
+    return np.asarray(z, dtype=np.float64).squeeze(), np.float32(Cs), sc.copy()
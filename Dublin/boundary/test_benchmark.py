@@ -0,0 +1,55 @@
+''' Regression test for the boundary forcing pipeline, through benchmark.py
+on a small synthetic case. Run with: python -m pytest '''
+
+import types
+import json
+import sys
+import os
+
+# The Copernicus client is not needed by the benchmark. Use a stand-in if it is missing
+sys.modules.setdefault('copernicusmarine', types.ModuleType('copernicusmarine'))
+import benchmark
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config')
+
+# Small case: a few seconds, with total alkalinity and every stage of make_boundary
+SIZES = ['--eta', '20', '--xi', '24', '-N', '5', '--lat', '12', '--lon', '12',
+        '--depth', '6', '--days', '2', '--steps', '4', '--pisces', '6']
+
+def run(tmp_path, *args):
+    ''' Run the benchmark in TMP_PATH. Returns the exit status and results '''
+
+    output = tmp_path / 'benchmark.json'
+    try:
+        benchmark.main(['--config', CONFIG, '--workdir', str(tmp_path / 'work'),
+            '-o', str(output)] + SIZES + list(args))
+        status = 0
+    except SystemExit as e:
+        status = e.code
+    with open(output, 'r') as f:
+        return status, json.load(f)
+
+def test_benchmark(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The benchmark changes directory
+    status, results = run(tmp_path)
+    assert status == 0
+    assert {'synthetic data', 'total_alkalinity', 'create_bry',
+            'make_bry_variables', 'make_boundary'} <= set(results['stages'])
+
+    # The path of the boundary file goes to the work directory, not /log
+    with open(tmp_path / 'work' / 'boundary.config', 'r') as f:
+        assert f.read() == f'bryname={tmp_path / "work" / "out" / "20250301" / "croco_bry.nc"}'
+
+    # Against its own results, with a generous tolerance for timing noise: no regressions
+    baseline = tmp_path / 'baseline.json'
+    os.replace(tmp_path / 'benchmark.json', baseline)
+    status, results = run(tmp_path, '--baseline', str(baseline), '--tolerance', '10')
+    assert status == 0
+
+def test_compare():
+    baseline = {'stages': {'a': dict(time=1., memory=10.), 'b': dict(time=1., memory=10.)}}
+    results = {'stages': {'a': dict(time=1.1, memory=10.), 'b': dict(time=1., memory=13.),
+        'c': dict(time=5., memory=50.)}}
+    # Stage b uses 30% more memory. Stage c is new, so it is not checked
+    assert benchmark.compare(results, baseline, .2) == ['b memory: 13.000 (baseline 10.000)']
+    assert benchmark.compare(results, baseline, .5) == []
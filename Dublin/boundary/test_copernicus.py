@@ -0,0 +1,146 @@
+''' Tests for the Copernicus download step (main.copernicus), against a local
+stand-in for the Copernicus Marine client. Run with: python -m pytest '''
+
+from netCDF4 import Dataset, num2date
+from datetime import datetime, timedelta
+import numpy as np
+import logging
+import types
+import sys
+import os
+
+# The client is only needed for real downloads. Use a stand-in if it is missing
+sys.modules.setdefault('copernicusmarine', types.ModuleType('copernicusmarine'))
+# Keep the logger of main (see log.py) away from the operational /log/app.log
+logging.basicConfig(handlers=[logging.NullHandler()])
+import main
+
+CONFIG = '''
+mydate 20250310
+days-back 1
+days-ahead 1
+west  -6.3
+east  -5.9
+south 53.2
+north 53.5
+cmemspath {path}
+cmemsworkers 2
+PISCES F
+DATASET-0 ds-2D-i   0
+DATASET-1 ds-2D-m   0.5
+DATASET-2 ds-short 12
+zeta   Y 0 zos    F
+ubar   Y 1 ubar   F
+vbar   Y 1 vbar   F
+u      N
+v      N
+temp   Y 2 thetao T
+salt   Y 2 so     T
+'''
+
+# Each CMEMS variable is filled with its own value, plus 10 for each day from EPOCH
+VALUES = {'zos': 1, 'ubar': 2, 'vbar': 3, 'thetao': 4, 'so': 5}
+EPOCH = datetime(2025, 3, 1)
+
+def fake_subset(calls):
+    ''' Stand-in for copernicusmarine.subset. Writes a daily file with all
+    the VARIABLES requested, and logs the request to CALLS. The "ds-short"
+    dataset stops two days early, as the biogeochemistry forecast does. '''
+
+    def subset(dataset_id=None, output_directory=None, output_filename=None,
+            variables=None, start_datetime=None, end_datetime=None, **kwargs):
+        with open(calls, 'a') as f:
+            f.write(f'{dataset_id} {" ".join(sorted(variables))} {start_datetime[:10]}\n')
+
+        start = datetime.strptime(start_datetime, '%Y-%m-%dT%H:%M:%S')
+        end = datetime.strptime(end_datetime, '%Y-%m-%dT%H:%M:%S')
+        T = (end - start).days + 1 - 2 * (dataset_id == 'ds-short')
+
+        with Dataset(os.path.join(output_directory, output_filename), 'w') as nc:
+            nc.createDimension('time', T)
+            nc.createDimension('latitude', 3)
+            nc.createDimension('longitude', 4)
+            time = nc.createVariable('time', 'f8', ('time',))
+            time.units = 'hours since 1950-01-01'
+            time[:] = (start - datetime(1950, 1, 1)).total_seconds() / 3600 + 24 * np.arange(T)
+            nc.createVariable('latitude', 'f4', ('latitude',))[:] = [53.2, 53.35, 53.5]
+            nc.createVariable('longitude', 'f4', ('longitude',))[:] = [-6.3, -6.2, -6.0, -5.9]
+            for name in variables:
+                var = nc.createVariable(name, 'f4', ('time', 'latitude', 'longitude'), fill_value=-999)
+                days = (start - EPOCH).days + np.arange(T)
+                var[:] = VALUES[name] + 10 * days[:, None, None] * np.ones((3, 4))
+    return subset
+
+def fake_describe(updated):
+    ''' Stand-in for copernicusmarine.describe. Every dataset was last
+    updated at UPDATED[0] '''
+
+    def describe(dataset_id=None, **kwargs):
+        part = types.SimpleNamespace(arco_updated_date=updated[0])
+        version = types.SimpleNamespace(parts=[part])
+        dataset = types.SimpleNamespace(versions=[version])
+        return types.SimpleNamespace(products=[types.SimpleNamespace(datasets=[dataset])])
+    return describe
+
+def check_files(path, first, T):
+    ''' Check the per-variable files in PATH, with T days from FIRST '''
+
+    last = first + timedelta(days=T - 1)
+    files = {v: path / f'cmems-{v}-{first:%Y%m%d}-{last:%Y%m%d}.nc' for v in ('zeta', 'ubar', 'vbar', 'temp', 'salt')}
+    # One file per variable, and no multi-variable downloads left
+    assert sorted(os.listdir(path)) == sorted(f.name for f in files.values())
+
+    for v, cdfvar, offset in (('zeta', 'zos', 0), ('ubar', 'ubar', .5), ('vbar', 'vbar', .5),
+            ('temp', 'thetao', 12), ('salt', 'so', 12)):
+        with Dataset(files[v], 'r') as nc:
+            assert set(nc.variables) == {'time', 'latitude', 'longitude', cdfvar}
+            time = num2date(nc.variables['time'][:], nc.variables['time'].units)
+            data = nc.variables[cdfvar][:]
+
+        # All days, with the dataset time offset added
+        expected = [first + timedelta(days=i, hours=offset) for i in range(T)]
+        assert [datetime(*i.timetuple()[:6]) for i in time] == expected
+
+        if cdfvar in ('thetao', 'so'):
+            # Short dataset: extended with the last record available
+            records = np.minimum(np.arange(T), T - 3)
+        else:
+            records = np.arange(T)
+        assert np.array_equal(data[:, 0, 0], VALUES[cdfvar] + 10 * ((first - EPOCH).days + records))
+
+def test_copernicus(tmp_path, monkeypatch):
+    path, calls = tmp_path / 'IBI', tmp_path / 'calls.txt'
+    (tmp_path / 'config').write_text(CONFIG.format(path=path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main.copernicusmarine, 'subset', fake_subset(calls), raising=False)
+
+    main.copernicus()
+
+    # One request per dataset, with all its variables
+    assert sorted(calls.read_text().splitlines()) == ['ds-2D-i zos 2025-03-09',
+            'ds-2D-m ubar vbar 2025-03-09', 'ds-short so thetao 2025-03-09']
+    check_files(path, datetime(2025, 3, 9), 4)
+
+def test_cache(tmp_path, monkeypatch):
+    path, calls = tmp_path / 'IBI', tmp_path / 'calls.txt'
+    config = CONFIG.format(path=path).replace('days-back 1', 'days-back 3')
+    (tmp_path / 'config').write_text(config + f'cmemscache {tmp_path / "CACHE"}\ncmemsupdate 1\n')
+    monkeypatch.chdir(tmp_path)
+    updated = ['2025-03-10T06:00:00Z']
+    monkeypatch.setattr(main.copernicusmarine, 'subset', fake_subset(calls), raising=False)
+    monkeypatch.setattr(main.copernicusmarine, 'describe', fake_describe(updated), raising=False)
+
+    def run():
+        if calls.exists():
+            calls.unlink()
+        main.copernicus()
+        check_files(path, datetime(2025, 3, 7), 6)
+        return sorted(calls.read_text().splitlines()) if calls.exists() else []
+
+    # First run: download all days
+    assert run() == ['ds-2D-i zos 2025-03-07', 'ds-2D-m ubar vbar 2025-03-07', 'ds-short so thetao 2025-03-07']
+    # Product not updated: all days from cache
+    assert run() == []
+    # Product updated: download the recent and forecast days again
+    updated[0] = '2025-03-10T18:00:00Z'
+    assert run() == ['ds-2D-i zos 2025-03-09', 'ds-2D-m ubar vbar 2025-03-09', 'ds-short so thetao 2025-03-09']
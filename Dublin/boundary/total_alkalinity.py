@@ -1,96 +1,35 @@
+from interpolate_boundary import read_boundary_grid
+from interpolation_weights import get_weights, boundary_slab
 from netCDF4 import Dataset
+from concurrent.futures import ProcessPoolExecutor
+from log import set_logger, now
+import multiprocessing
 import PyCO2SYS as pyco2
 import numpy as np
 import gsw
 import os
 
-def total_alkalinity(config, idatestr, edatestr):
-    ''' Total alkalinity calculation '''
-    # Path to downloaded CMEMS files
-    path = config.get('cmemspath') + '/'
-    
-    filename = f'{path}cmems-DIC-{idatestr}-{edatestr}.nc' 
-    if os.path.isfile(filename):
-        with Dataset(filename) as nc:
-            # Read longitude
-            lon = nc.variables['longitude'][:]; L = len(lon)
-            # Read latitude
-            lat = nc.variables['latitude'][:];  M = len(lat)
-            # Read depth
-            depth = nc.variables['depth'][:];   N = len(depth)
-            # Read time 
-            time = nc.variables['time'][:];     T = len(time)
-            # Read time units
-            units = nc.variables['time'].units
-            # Read Dissolved Inorganic Carbon
-            DIC = nc.variables[config.get('DIC')[2]][:]
-    else:
-        raise FileNotFoundError('Error while calculating Total Alkalinity: DIC file is missing')
-        
-    # Reshape longitude to fit 4-D array
-    LON = np.tile(lon, (T, M, N, 1))
-    LON = np.transpose(LON, (0, 2, 1, 3))
-    # Reshape latitude to fit 4-D array
-    LAT = np.tile(lat, (T, L, N, 1))
-    LAT = np.transpose(LAT, (0, 2, 3, 1))
-    # Reshape depth to fit 4-D array
-    DEPTH = np.tile(depth, (T, M, L, 1))
-    DEPTH = np.transpose(DEPTH, (0, 3, 1, 2))
-
-    filename = f'{path}cmems-temp-{idatestr}-{edatestr}.nc' 
-    if os.path.isfile(filename):
-        with Dataset(filename) as nc:            
-            # Read temperature
-            thetao = nc.variables[config.get('temp')[2]][:]
-    else:
-        raise FileNotFoundError('Error while calculating Total Alkalinity: temperature file is missing')
-
-    filename = f'{path}cmems-salt-{idatestr}-{edatestr}.nc' 
-    if os.path.isfile(filename):
-        with Dataset(filename) as nc:
-            # Read salinity
-            so = nc.variables[config.get('salt')[2]][:]
-    else:
-        raise FileNotFoundError('Error while calculating Total Alkalinity: salinity file is missing')
-
-    filename = f'{path}cmems-pH-{idatestr}-{edatestr}.nc' 
-    if os.path.isfile(filename):
-        with Dataset(filename) as nc:
-            # Read pH
-            pH = nc.variables[config.get('pH')[2]][:]
-    else:
-        raise FileNotFoundError('Error while calculating Total Alkalinity: pH file is missing')
+logger = set_logger()
 
-    filename = f'{path}cmems-NH4-{idatestr}-{edatestr}.nc' 
-    if os.path.isfile(filename):
-        with Dataset(filename) as nc:
-            # Read ammonia
-            NH4 = nc.variables[config.get('NH4')[2]][:]
-    else:
-        raise FileNotFoundError('Error while calculating Total Alkalinity: NH4 file is missing')
+# Variables needed to calculate total alkalinity, as named in the error messages
+INPUTS = {'DIC': 'DIC', 'temp': 'temperature', 'salt': 'salinity',
+        'pH': 'pH', 'NH4': 'NH4', 'PO4': 'PO4', 'Si': 'Si'}
 
-    filename = f'{path}cmems-PO4-{idatestr}-{edatestr}.nc' 
-    if os.path.isfile(filename):
-        with Dataset(filename) as nc:
-            # Read phosphate
-            PO4 = nc.variables[config.get('PO4')[2]][:]
-    else:
-        raise FileNotFoundError('Error while calculating Total Alkalinity: PO4 file is missing')
+# Approximate working memory per ocean cell [bytes], mostly taken
+# by the intermediate results of gsw and PyCO2SYS
+CELL_BYTES = 4096
 
-    filename = f'{path}cmems-Si-{idatestr}-{edatestr}.nc' 
-    if os.path.isfile(filename):
-        with Dataset(filename) as nc:
-            # Read silicon
-            Si = nc.variables[config.get('Si')[2]][:]
-    else:
-        raise FileNotFoundError('Error while calculating Total Alkalinity: Si file is missing')
+def carbonate_system(DIC, thetao, so, pH, NH4, PO4, Si, depth, lat, lon):
+    ''' Calculate total alkalinity [mol m-3] from CMEMS variables. Inputs
+    can be any arrays that broadcast together, e.g. the 1-D list of ocean
+    cells and their depth, latitude and longitude. '''
 
     # Calculate Absolute Salinity
-    SA = gsw.conversions.SA_from_SP(so, DEPTH, LON, LAT)
+    SA = gsw.conversions.SA_from_SP(so, depth, lon, lat)
     # Calculate Conservative Temperature
     CT = gsw.conversions.CT_from_pt(SA, thetao)
     # Calculate density
-    density = gsw.density.rho(SA, CT, DEPTH)
+    density = gsw.density.rho(SA, CT, depth)
 
     # Transform DIC units
     DIC = 1e6 * np.divide(DIC, density) # From mol m-3 to umol kg-1
@@ -102,14 +41,100 @@ def total_alkalinity(config, idatestr, edatestr):
 
     # Calculate carbonate system
     co2sys = pyco2.sys(par1=DIC, par2=pH, par1_type=2, par2_type=3,
-            salinity=so, temperature=thetao, pressure=DEPTH,
+            salinity=so, temperature=thetao, pressure=depth,
             total_silicate=Si, total_phosphate=PO4, total_ammonia=NH4)
 
     # Get Total Alkalinity
-    TALK = 1e-6 * np.multiply(co2sys.get('alkalinity'), density)
+    return 1e-6 * np.multiply(co2sys.get('alkalinity'), density)
+
+def talk_chunk(config, files, records, rows, columns, depth, lat, lon):
+    ''' Calculate total alkalinity for a time chunk (RECORDS) and lat/lon
+    window (ROWS, COLUMNS) of the CMEMS grid. Land cells, masked in any
+    of the input variables, are skipped and returned masked. '''
+
+    data = {}
+    for v, f in files.items():
+        with Dataset(f, 'r') as nc:
+            data[v] = nc.variables[config.get(v)[2]][records, :, rows, columns]
+
+    # Ocean cells: valid in all input variables
+    ocean = ~np.logical_or.reduce([np.ma.getmaskarray(i) for i in data.values()])
+
+    TALK = np.ma.masked_all(ocean.shape)
+    if ocean.any():
+        # Depth, latitude and longitude of each ocean cell
+        _, k, j, i = np.nonzero(ocean)
+        TALK[ocean] = carbonate_system(*(np.ma.getdata(data[v])[ocean] for v in INPUTS),
+                depth[k], lat[rows][j], lon[columns][i])
+
+    return records, rows, columns, TALK
+
+def talk_windows(config, lat, lon):
+    ''' Lat/lon windows of the CMEMS grid where total alkalinity is needed.
+    This is the whole grid, unless "talkboundary" is set to T in the
+    configuration file. Then, only the slab around each open boundary
+    used for the boundary interpolation is returned. '''
+
+    M, L = len(lat), len(lon)
+    if config.get('talkboundary') != 'T':
+        return [(slice(0, M), slice(0, L))]
+
+    # Open boundaries, as in make_boundary
+    config = dict(config, OpenBoundaries=[int(i) for i in config.get('obc')])
+
+    # Horizontal interpolation weights, shared with make_boundary if "weightspath" is set
+    weights = get_weights(config, 'rho', lat, lon, read_boundary_grid(config, 'rho'))
+
+    return [boundary_slab(W, M, L)[0:2] for W in weights.values()]
+
+def total_alkalinity(config, idatestr, edatestr):
+    ''' Total alkalinity calculation. The result is saved to
+    cmems-TALK-{idatestr}-{edatestr}.nc, which has the same structure as
+    the other CMEMS files, so it can be interpolated to the boundaries.
+
+    The carbonate system is solved for ocean cells only, in time chunks
+    that fit in the "talkmemory" budget [MB] (if set in the configuration
+    file), by "talkworkers" processes in parallel. If "talkboundary" is
+    T, only the areas needed for the open boundaries are calculated. '''
+
+    # Path to downloaded CMEMS files
+    path = config.get('cmemspath') + '/'
+
+    files = {}
+    for v, name in INPUTS.items():
+        filename = f'{path}cmems-{v}-{idatestr}-{edatestr}.nc'
+        if not os.path.isfile(filename):
+            raise FileNotFoundError(f'Error while calculating Total Alkalinity: {name} file is missing')
+        files[v] = filename
+
+    with Dataset(files['DIC']) as nc:
+        # Read longitude
+        lon = nc.variables['longitude'][:]; L = len(lon)
+        # Read latitude
+        lat = nc.variables['latitude'][:];  M = len(lat)
+        # Read depth
+        depth = nc.variables['depth'][:];   N = len(depth)
+        # Read time
+        time = nc.variables['time'][:];     T = len(time)
+        # Read time units
+        units = nc.variables['time'].units
+
+    windows = talk_windows(config, lat, lon)
+
+    workers = int(config.get('talkworkers', 1))
+
+    ''' Set chunk length (in time records), sharing the memory budget among workers '''
+    if config.get('talkmemory'):
+        size = CELL_BYTES * N * max((r.stop - r.start) * (c.stop - c.start) for r, c in windows)
+        chunk = max(1, int(float(config.get('talkmemory')) * 1024**2 / workers // size))
+    else:
+        chunk = T
+
+    tasks = [(slice(start, min(start + chunk, T)), rows, columns)
+            for start in range(0, T, chunk) for rows, columns in windows]
 
     # Save to NetCDF. Total alkalinity will be read from this NetCDF for interpolations
-    filename = f'{path}cmems-TALK-{idatestr}-{edatestr}.nc' 
+    filename = f'{path}cmems-TALK-{idatestr}-{edatestr}.nc'
     with Dataset(filename, 'w', format='NETCDF4') as nc:
         # NetCDF should have the same structure as a regular CMEMS file
         nc.createDimension('longitude', L)
@@ -146,4 +171,19 @@ def total_alkalinity(config, idatestr, edatestr):
             'depth', 'latitude', 'longitude'), fill_value=-32767)
         talk.long_name = 'total alkalinity'
         talk.units = 'mmol m-3'
-        talk[:] = TALK
+
+        logger.info(f'{now()} Calculating total alkalinity in {len(tasks)} chunks with {workers} workers')
+        if workers <= 1:
+            for records, rows, columns in tasks:
+                _, _, _, TALK = talk_chunk(config, files, records, rows, columns, depth, lat, lon)
+                talk[records, :, rows, columns] = TALK
+            return
+
+        # Write from this process only, as chunks are ready
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [pool.submit(talk_chunk, config, files, records, rows, columns,
+                depth, lat, lon) for records, rows, columns in tasks]
+            for future in futures:
+                records, rows, columns, TALK = future.result()
+                talk[records, :, rows, columns] = TALK
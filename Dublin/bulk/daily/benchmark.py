@@ -0,0 +1,91 @@
+from write_bulk import READERS, SHORTNAMES
+import numpy as np
+import tracemalloc
+import argparse
+import platform
+import glob
+import json
+import time
+import sys
+
+def decode_all(reader, files):
+    ''' Decode FILES with READER. Returns the decoded fields of each file,
+    the wall time and the peak memory [MB] '''
+
+    tracemalloc.start(); tracemalloc.reset_peak()
+    start = time.perf_counter()
+    fields = [READERS[reader](f) for f in files]
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+    return fields, elapsed, peak / 1024**2
+
+def compare(files, reference, fields):
+    ''' Compare the decoded FIELDS against REFERENCE. Return the list of
+    differences found, file by file '''
+
+    differences = []
+    for f, a, b in zip(files, reference, fields):
+        if set(a) != set(b):
+            differences.append(f'{f}: fields {sorted(a)} and {sorted(b)}')
+            continue
+        for name in a:
+            if a[name].shape != b[name].shape or a[name].dtype != b[name].dtype:
+                differences.append(f'{f}: {name} is {a[name].dtype}{a[name].shape} '
+                        f'and {b[name].dtype}{b[name].shape}')
+            elif not np.array_equal(a[name], b[name], equal_nan=name != 'valid_time'):
+                differences.append(f'{f}: {name} values differ')
+    return differences
+
+def main():
+
+    msg = ''' Benchmark the GRIB readers of the daily bulk forcing (cfgrib and eccodes)
+              on sample ECMWF GRIB files. Each reader decodes all the files several
+              times, and the best wall time is kept. The fields from every reader are
+              checked against those from the first one, and the benchmark fails (exit
+              status 1) if they differ. Results are written to a JSON file. '''
+
+    # Initialize argument parser
+    parser = argparse.ArgumentParser(description=msg)
+    # Define command-line arguments
+    parser.add_argument('files', nargs='+', help='GRIB files (or glob patterns)')
+    parser.add_argument('--readers', nargs='+', default=list(READERS), choices=list(READERS),
+            help='GRIB readers to compare')
+    parser.add_argument('--repeat', type=int, default=3, help='Times each reader decodes all the files')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='Results (JSON)')
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
+    files = sorted(f for pattern in args.files for f in glob.glob(pattern))
+    if not files:
+        sys.exit('No GRIB files found')
+    print(f'{len(files)} GRIB files, {len(SHORTNAMES)} fields each')
+
+    results, reference, differences = {}, None, []
+    for reader in args.readers:
+        runs = [decode_all(reader, files) for i in range(args.repeat)]
+        fields = runs[0][0]
+        elapsed, peak = min(i[1] for i in runs), max(i[2] for i in runs)
+        results[reader] = dict(time=elapsed, memory=peak, per_file=elapsed / len(files))
+        print(f'{reader:>10s}: {elapsed:9.3f} s {peak:10.1f} MB {1e3 * elapsed / len(files):9.1f} ms/file')
+
+        # Check fields against the first reader
+        if reference is None:
+            reference = fields
+        else:
+            differences += compare(files, reference, fields)
+
+    with open(args.output, 'w') as f:
+        json.dump(dict(files=len(files), repeat=args.repeat, readers=results,
+            python=platform.python_version(), numpy=np.__version__,
+            differences=differences), f, indent=2)
+    print(f'Results written to {args.output}')
+
+    for i in differences:
+        print(f'DIFFERENT {i}')
+    if differences:
+        sys.exit(1)
+    print('All readers give the same fields')
+
+if __name__ == '__main__':
+    main()
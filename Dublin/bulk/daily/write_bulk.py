@@ -1,7 +1,25 @@
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from ecmwf2croco import crop_window, INPUTS
+from create_bulk import create_bulk
+from os.path import basename
 from netCDF4 import Dataset
+import multiprocessing
 import xarray as xr
 import numpy as np
+import eccodes
+import glob
+import time
+import os
+
+from log import set_logger, now
+
+logger = set_logger()
+
+# GRIB fields needed for bulk forcing: cfgrib short name to GRIB shortName
+SHORTNAMES = {'msl': 'msl', 't2m': '2t', 'd2m': '2d', 'tcc': 'tcc', 'u10': '10u',
+        'v10': '10v', 'tp': 'tp', 'ssr': 'ssr', 'str': 'str', 'strd': 'strd'}
 
 def to_datetime(date):
     ''' Converts a numpy datetime64 to a Python datetime '''
@@ -18,116 +36,491 @@ def rh(t2m, d2m):
     Es = 0.611 * np.exp(5423 * ((1/T0)-(1./t2m)))
     return 100 * (E/Es)
 
-def write_bulk(faire, fflux, fwind, time, index, grib1, grib2=''):
-    ''' Read ECMWF Grib file '''
+def decode_cfgrib(grib):
+    ''' Decode the fields needed for bulk forcing (SHORTNAMES) in a GRIB
+    file with xarray and cfgrib. Other messages are not decoded. Returns a
+    dictionary of NumPy arrays, by cfgrib short name, in the order of the
+    file, and the valid time. '''
+
+    with xr.load_dataset(grib, engine='cfgrib', backend_kwargs={'indexpath': '',
+            'filter_by_keys': {'shortName': list(SHORTNAMES.values())}}) as ds:
+        return {name: ds.variables[name].data for name in list(ds.data_vars) + ['valid_time']}
+
+def decode_eccodes(grib):
+    ''' Same as decode_cfgrib, iterating over the GRIB messages with eccodes
+    directly. No xarray Dataset is built, and no index file is written. '''
+
+    names = {v: k for k, v in SHORTNAMES.items()}
+
+    fields = {}
+    with open(grib, 'rb') as f:
+        while True:
+            gid = eccodes.codes_grib_new_from_file(f)
+            if gid is None:
+                break
+            try:
+                name = names.get(eccodes.codes_get(gid, 'shortName'))
+                if name is None:
+                    continue # Not needed
+                data = eccodes.codes_get_values(gid).reshape(
+                        eccodes.codes_get(gid, 'Nj'), eccodes.codes_get(gid, 'Ni'))
+                # Missing values to NaN, as cfgrib does
+                if eccodes.codes_get(gid, 'bitmapPresent'):
+                    data[data == eccodes.codes_get(gid, 'missingValue')] = np.nan
+                fields[name] = data.astype(np.float32)
+
+                day, hour = str(eccodes.codes_get(gid, 'validityDate')), eccodes.codes_get(gid, 'validityTime')
+                fields['valid_time'] = np.array(np.datetime64(
+                    f'{day[0:4]}-{day[4:6]}-{day[6:8]}T{hour // 100:02d}:{hour % 100:02d}', 'ns'))
+            finally:
+                eccodes.codes_release(gid)
+
+    return fields
+
+# GRIB readers, selected with "gribreader" in the configuration file
+READERS = {'cfgrib': decode_cfgrib, 'eccodes': decode_eccodes}
+
+def decode_grib(grib, crop=None, reader='cfgrib'):
+    ''' Decode the fields needed for bulk forcing in a GRIB file with READER,
+    all at once. Returns them by cfgrib short name. Fields are flipped to
+    south-north order, and cropped to CROP (j0, j1, i0, i1), if given. '''
+
+    fields = {}
+    for name, data in READERS[reader](grib).items():
+        if name != 'valid_time':
+            data = np.flip(data, axis=0)
+            if crop:
+                j0, j1, i0, i1 = crop
+                # Copy, so that the whole field is not kept in memory
+                data = np.ascontiguousarray(data[j0:j1, i0:i1])
+        fields[name] = data
+    return fields
+
+# Accumulated ECMWF fields: (output file, NetCDF variable, conversion factor).
+# Output files are 0: air, 1: radiation, 2: wind.
+ACCUMULATED = OrderedDict([
+    ('tp',   (0, 'rain', 1000)), # Rainfall [m]. Convert to kg m-2 s-1
+    ('ssr',  (1, 'swrad', 1)),   # Solar shortwave radiation [J m-2]. Convert to W m-2
+    ('str',  (1, 'lwrad', 1)),   # Net longwave radiation [J m-2]. Convert to W m-2
+    ('strd', (1, 'lwrad_down', 1)), # Downwelling longwave radiation [J m-2]. Convert to W m-2
+])
+
+def deaccumulate(stack, runs, steps, factor=1):
+    ''' De-accumulate a time stack (T, M, L) of an ECMWF accumulated field
+    in one go. RUNS is the forecast run (e.g. its start time) of each record,
+    and STEPS its forecast step [hours]. Records of the same run must be
+    consecutive and in increasing step order.
+
+    ECMWF fields are accumulated from the start of each run (00 or 12), so
+    each record is subtracted the previous record of the same run, while
+    the first record of a run is accumulated from step 0. Then, the result
+    is multiplied by FACTOR and divided by the length of the interval [s],
+    which may change along the stack (e.g. hourly IQS files followed by
+    the 6-hourly steps of the IQD file). '''
+
+    runs, steps = np.asarray(runs), np.asarray(steps)
+
+    # Records starting a new run
+    first = np.ones(len(runs), dtype=bool); first[1:] = runs[1:] != runs[:-1]
+
+    # Accumulation over the interval ending at each record
+    rates = np.array(stack)
+    rates[1:][~first[1:]] -= stack[:-1][~first[1:]]
+
+    # Interval length [s]
+    interval = np.where(first, steps, steps - np.roll(steps, 1))
+    seconds = (3600 * interval).astype(rates.dtype).reshape((-1,) + (1,)*(rates.ndim - 1))
+
+    return factor * rates / seconds
+
+def read_fields(time, grib, instantaneous=True, crop=None, reader='cfgrib'):
+    ''' Read ECMWF Grib file. Returns an error flag, the instantaneous fields
+    converted to CROCO units, as a list of (output file, NetCDF variable,
+    data), and the accumulated fields, to be de-accumulated later on, all
+    cropped to CROP (j0, j1, i0, i1), if given, and decoded with READER
+    ('cfgrib' or 'eccodes'). Fields are checked in
+    order, and reading stops at the first wrong one. If the GRIB file cannot
+    be decoded (e.g. it is missing), the accumulated fields are None. This
+    runs in the worker processes when GRIB files are decoded in parallel. '''
 
     eflag = False # Error flag
 
-    with xr.load_dataset(grib1, engine='cfgrib') as ds:
-        # Read time
-        t = to_datetime(ds.variables.get('valid_time').data)
-        # Check time is correct
-        try:
-            assert(time == t)
-        except AssertionError:
-            eflag = True; return eflag
-        
-        # Air pressure. Convert to millibar
-        msl = .01*np.flip(ds.variables.get('msl').data, axis=0)
-        if np.any(np.isnan(msl)):
-            eflag = True; return eflag
-        with Dataset(faire, 'a') as nc:
-            nc.variables['Pair'][index, :, :] = msl
-
-        # Air temperature
-        t2m = np.flip(ds.variables.get('t2m').data, axis=0)
-        if np.any(np.isnan(t2m)):
-            eflag = True; return eflag
-        with Dataset(faire, 'a') as nc:
-            nc.variables['Tair'][index, :, :] = t2m - 273.15 # Celsius
-
-        # Relative humidity. Calculate from dewpoint temperature
-        d2m = rh(t2m, np.flip(ds.variables.get('d2m').data, axis=0))
-        if np.any(np.isnan(d2m)):
-            eflag = True; return eflag
-        with Dataset(faire, 'a') as nc:
-            nc.variables['Qair'][index, :, :] = d2m
-
-        # Total cloud cover
-        tcc = np.flip(ds.variables.get('tcc').data, axis=0)
-        if np.any(np.isnan(tcc)):
-            eflag = True; return eflag
-        with Dataset(faire, 'a') as nc:
-            nc.variables['cloud'][index, :, :] = tcc
-
-        # Rainfall rate
-        tp = np.flip(ds.variables.get('tp').data, axis=0)
-        if grib2:
-            with xr.load_dataset(grib2, engine='cfgrib') as ds2:
-                tp2 = np.flip(ds2.variables.get('tp').data, axis=0)
-            # Subtract  
-            tp -= tp2
-        # This is accumulated rainfal [m] over 1 hour. Convert to kg m-2 s-1
-        tp = 1000 * tp / 3600 
-        # Get rid of negative values resulting from subtraction
-        tp[tp < 0] = 0
-        if np.any(np.isnan(tp)):
-            eflag = True; return eflag
-        with Dataset(faire, 'a') as nc:
-            nc.variables['rain'][index, :, :] = tp
-
-        # Solar shortwave radiation
-        ssr = np.flip(ds.variables.get('ssr').data, axis=0)
-        if grib2:
-            with xr.load_dataset(grib2, engine='cfgrib') as ds2:
-                ssr2 = np.flip(ds2.variables.get('ssr').data, axis=0)
-            # Subtract
-            ssr -= ssr2
-        # Convert to Watts m-2
-        ssr = ssr / 3600
-        if np.any(np.isnan(ssr)):
-            eflag = True; return eflag
-        with Dataset(fflux, 'a') as nc:
-            nc.variables['swrad'][index, :, :] = ssr
-
-        # Net longwave radiation
-        str = np.flip(ds.variables.get('str').data, axis=0)
-        if grib2:
-            with xr.load_dataset(grib2, engine='cfgrib') as ds2:
-                str2 = np.flip(ds2.variables.get('str').data, axis=0)
-            # Subtract
-            str -= str2
-        # Convert to Watts m-2
-        str = str / 3600
-        if np.any(np.isnan(str)):
-            eflag = True; return eflag
-        with Dataset(fflux, 'a') as nc:
-            nc.variables['lwrad'][index, :, :] = str
-
-        # Downwelling longwave radiation
-        strd = np.flip(ds.variables.get('strd').data, axis=0)
-        if grib2:
-            with xr.load_dataset(grib2, engine='cfgrib') as ds2:
-                strd2 = np.flip(ds2.variables.get('strd').data, axis=0)
-            # Subtract
-            strd -= strd2
-        # Convert to Watts m-2
-        strd = strd / 3600
-        if np.any(np.isnan(strd)):
-            eflag = True; return eflag
-        with Dataset(fflux, 'a') as nc:
-            nc.variables['lwrad_down'][index, :, :] = strd
-
-        # wind
-        u10 = np.flip(ds.variables.get('u10').data, axis=0)
-        if np.any(np.isnan(u10)):
-            eflag = True; return eflag
-        with Dataset(fwind, 'a') as nc:
-            nc.variables['Uwind'][index, :, :] = u10
-        v10 = np.flip(ds.variables.get('v10').data, axis=0)
-        if np.any(np.isnan(v10)):
-            eflag = True; return eflag
-        with Dataset(fwind, 'a') as nc:
-            nc.variables['Vwind'][index, :, :] = v10
-
-        return eflag
+    # Decode the GRIB file once
+    try:
+        decoded = decode_grib(grib, crop, reader)
+    except Exception as e:
+        logger.error(f'{now()} Exception while decoding {grib}: {e}')
+        eflag = True; return eflag, [], dict.fromkeys(ACCUMULATED)
+
+    # Accumulated fields
+    accumulated = {name: decoded[name] for name in ACCUMULATED}
+
+    fields = []
+    if not instantaneous:
+        return eflag, fields, accumulated
+
+    # Read time
+    t = to_datetime(decoded['valid_time'])
+    # Check time is correct
+    try:
+        assert(time == t)
+    except AssertionError:
+        eflag = True; return eflag, fields, accumulated
+    
+    # Air pressure. Convert to millibar
+    msl = .01*decoded['msl']
+    if np.any(np.isnan(msl)):
+        eflag = True; return eflag, fields, accumulated
+    fields.append((0, 'Pair', msl))
+
+    # Air temperature
+    t2m = decoded['t2m']
+    if np.any(np.isnan(t2m)):
+        eflag = True; return eflag, fields, accumulated
+    fields.append((0, 'Tair', t2m - 273.15)) # Celsius
+
+    # Relative humidity. Calculate from dewpoint temperature
+    d2m = rh(t2m, decoded['d2m'])
+    if np.any(np.isnan(d2m)):
+        eflag = True; return eflag, fields, accumulated
+    fields.append((0, 'Qair', d2m))
+
+    # Total cloud cover
+    tcc = decoded['tcc']
+    if np.any(np.isnan(tcc)):
+        eflag = True; return eflag, fields, accumulated
+    fields.append((0, 'cloud', tcc))
+
+    # wind
+    u10 = decoded['u10']
+    if np.any(np.isnan(u10)):
+        eflag = True; return eflag, fields, accumulated
+    fields.append((2, 'Uwind', u10))
+    v10 = decoded['v10']
+    if np.any(np.isnan(v10)):
+        eflag = True; return eflag, fields, accumulated
+    fields.append((2, 'Vwind', v10))
+
+    return eflag, fields, accumulated
+
+def write_fields(files, index, fields):
+    ''' Write FIELDS, a list of (output file, NetCDF variable, data), into
+    the time record INDEX of FILES, opening each file once '''
+
+    for f in sorted(set(i[0] for i in fields)):
+        with Dataset(files[f], 'a') as nc:
+            for g, variable, data in fields:
+                if g == f:
+                    nc.variables[variable][index, :, :] = data
+
+def read_cycle(records, workers=1, crop=None, reader='cfgrib'):
+    ''' Read the GRIB files of RECORDS (see write_cycle), yielding the
+    results of read_fields in order. With more than one worker, files are
+    decoded by a pool of processes, a few records ahead of the one being
+    written, so that decoding overlaps with writing. '''
+
+    if workers <= 1:
+        for time, grib, run, files, index in records:
+            yield read_fields(time, grib, files is not None, crop, reader)
+        return
+
+    # Fork, so that workers start straight away. Only this process writes NetCDF
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        queue = deque()
+        for time, grib, run, files, index in records:
+            queue.append(pool.submit(read_fields, time, grib, files is not None, crop, reader))
+            # Keep a bounded number of decoded records in memory
+            if len(queue) > 2 * workers:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+
+def write_cycle(records, workers=1, crop=None, reader='cfgrib', keep=None, window=None):
+    ''' Write bulk forcing for a forecast cycle. RECORDS is a list of
+    (time, grib, run, files, index) in time order, where RUN is the start
+    time of the forecast run that produced the GRIB file, FILES are the
+    (air, radiation, wind) NetCDF files and INDEX the time record to write
+    to. FILES is None for records only needed as the start of the first
+    interval to de-accumulate, which are not written.
+
+    GRIB files are decoded with READER by WORKERS processes, cropped to
+    CROP, while this process writes the instantaneous fields in index
+    order. The accumulated fields are collected and de-accumulated all at
+    once at the end. Returns the list of (files, index) that could not be
+    written.
+
+    If KEEP (a dict) is given, the fields written that the CROCO online bulk
+    forcing needs (INPUTS) are also kept there, as {time: {NetCDF variable:
+    field}}, as stored in the files (float64), so that the online products
+    can be made from them without reading them back. Only the lat/lon WINDOW
+    (j0, j1, i0, i1) of each field is kept, if given. '''
+
+    j0, j1, i0, i1 = window or (None,) * 4
+
+    stacks = {name: [] for name in ACCUMULATED}
+    runs, steps, errors = [], [], []
+    for (time, grib, run, files, index), (eflag, fields, accumulated) in zip(
+            records, read_cycle(records, workers, crop, reader)):
+        if files is not None:
+            logger.info(f'{now()}     {time.strftime("%m%d%H")}')
+            write_fields(files, index, fields)
+            if eflag:
+                errors.append((files, index))
+            elif keep is not None:
+                # Copy, so that the whole field is not kept in memory
+                keep[time] = {variable: np.array(data[j0:j1, i0:i1], np.float64)
+                        for f, variable, data in fields if variable in INPUTS}
+        for name in ACCUMULATED:
+            stacks[name].append(accumulated[name])
+        runs.append(run); steps.append((time - run) / timedelta(hours=1))
+
+    # Records that could not be decoded have missing (NaN) accumulated fields. So
+    # they, and the records de-accumulated from them, are errors like any other
+    for name, stack in stacks.items():
+        reference = next((data for data in stack if data is not None), None)
+        if reference is None: # Nothing decoded
+            return errors
+        stacks[name] = [np.full_like(reference, np.nan) if data is None else data for data in stack]
+
+    # De-accumulate each field for the whole cycle
+    rates = {}
+    for name, (f, variable, factor) in ACCUMULATED.items():
+        rates[name] = deaccumulate(np.stack(stacks[name]), runs, steps, factor)
+        if name == 'tp':
+            # Get rid of negative values resulting from subtraction
+            rates[name][rates[name] < 0] = 0
+
+    # Fields of each record are written in order, up to the first with missing values
+    writes = {}
+    for k, (time, grib, run, files, index) in enumerate(records):
+        if files is None or (files, index) in errors:
+            continue
+        for name, (f, variable, factor) in ACCUMULATED.items():
+            if np.any(np.isnan(rates[name][k])):
+                errors.append((files, index))
+                if keep is not None:
+                    keep.pop(time, None)
+                break
+            writes.setdefault(files[f], []).append((index, variable, rates[name][k]))
+            if keep is not None and variable in INPUTS:
+                keep[time][variable] = np.array(rates[name][k][j0:j1, i0:i1], np.float64)
+
+    # Write them, opening each output file once
+    for filename, fields in writes.items():
+        with Dataset(filename, 'a') as nc:
+            for index, variable, data in fields:
+                nc.variables[variable][index, :, :] = data
+
+    return errors
+
+def get_ECMWF_grid(config):
+    ''' Get ECMWF grid domain and resolution '''
+
+    # Western and eastern boundaries [degrees east]
+    w, e = float(config.get('ECMWF_W')), float(config.get('ECMWF_E'))
+    # Southern and northern boundaries [degrees north]
+    s, n = float(config.get('ECMWF_S')), float(config.get('ECMWF_N'))
+
+    # Grid resolution [deg]
+    D = float(config.get('ECMWF_DH'))
+
+    return np.arange(w, e+D, D), np.arange(s, n+D, D) # Return ECMWF grid
+
+def get_crop(config, lon, lat):
+    ''' Cropping box (j0, j1, i0, i1) of the ECMWF grid (LON, LAT) that
+    covers the CROCO grid ("bulkgrid") plus a margin [degrees] ("bulkmargin").
+    None, to keep the whole ECMWF grid, if no CROCO grid is set. '''
+
+    if not config.get('bulkgrid'):
+        return None
+
+    margin = float(config.get('bulkmargin', 0))
+    with Dataset(config.get('bulkgrid'), 'r') as nc:
+        lon_rho = nc.variables['lon_rho'][:]
+        lat_rho = nc.variables['lat_rho'][:]
+
+    i = np.where((lon >= lon_rho.min() - margin) & (lon <= lon_rho.max() + margin))[0]
+    j = np.where((lat >= lat_rho.min() - margin) & (lat <= lat_rho.max() + margin))[0]
+    if not len(i) or not len(j):
+        raise ValueError('CROCO grid is outside the ECMWF grid')
+
+    return int(j[0]), int(j[-1]) + 1, int(i[0]), int(i[-1]) + 1
+
+def make_daily(config, memory=None):
+    ''' Create the daily ECMWF bulk forcing files: today's HC day, and four
+    FC days from tomorrow. If MEMORY is given, as {'HC' or 'FC': {}}, the
+    fields written to those files that the online bulk forcing reads are
+    also kept there, for the model area only (see write_cycle). '''
+
+    memory = memory or {}
+
+    ''' Setting time '''
+    # Set start time for bulk forcing (last midnight)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    # Yesterday date is also needed to retrieve the name of some GRIB files
+    yesterday = today - timedelta(days=1)
+    # First, set up some useful date strings
+    yearYesterday = yesterday.strftime('%Y')
+    dateYesterday = yesterday.strftime('%m%d')
+    yearToday = today.strftime('%Y')
+    dateToday = today.strftime('%m%d')
+
+    # Time list for bulk forcing (24 hours, hourly)
+    time = np.arange(today, today+timedelta(days=1), timedelta(hours=1))
+    # Get CROCO refence time
+    offset = datetime.strptime(config.get('offset'), '%Y%m%d')
+    # Convert to days since offset
+    time = np.array([(to_datetime(i) - offset).total_seconds()/86400 for i in time])
+
+    # Set output directory to save NetCDF files
+    metpath = config.get('metpath')
+
+    # Number of processes to decode GRIB files
+    workers = int(config.get('bulkworkers', 1))
+    # GRIB reader: cfgrib or eccodes
+    reader = config.get('gribreader', 'cfgrib')
+
+    ''' Set ECMWF grid (defined in configuration) '''
+    lon, lat = get_ECMWF_grid(config)
+    # Crop to the CROCO grid, if set. Only this area is decoded and written
+    crop = get_crop(config, lon, lat)
+    if crop:
+        j0, j1, i0, i1 = crop; lon, lat = lon[i0:i1], lat[j0:j1]
+    # Model area of the online bulk forcing, for the fields kept in memory
+    window = crop_window(config, lon, lat)
+
+    ''' Process Hindcast '''
+    hindcastPath = metpath + 'HC/'; logger.info(f'{now()} Creating ECMWF HC files...')
+    # Remove NetCDF files older than 10 days
+    clean(hindcastPath, 10)
+    # Set path for NetCDF files
+    ncPath = hindcastPath + 'NETCDF/' + today.strftime('%Y') + '/'
+    if not os.path.isdir(ncPath):
+        os.makedirs(ncPath)
+
+    ''' Setting output NetCDF file names '''
+    datestring = today.strftime('%Y%m%d')
+    fwind = ncPath + 'ECMWF_wind_' + datestring + '.nc' # Wind
+    fflux = ncPath + 'ECMWF_hf_'   + datestring + '.nc' # Radiation
+    faire = ncPath + 'ECMWF_air_'  + datestring + '.nc' # T, P, Q, rain
+
+    ''' Create forcing files '''
+    # Get dimensions
+    L, M, T = len(lon), len(lat),len(time)
+    # Create NetCDF files
+    logger.info(f'{now()} Creating {basename(faire)}, {basename(fflux)}, {basename(fwind)}...')
+    create_bulk(faire, fflux, fwind, L, M, T, offset, lon, lat, time)
+
+    ''' Build the list of records for this cycle '''
+    # Index 0 comes from yesterday's 12Z run. Step 11 is only needed to de-accumulate
+    run = yesterday + timedelta(hours=12)
+    gribPath = hindcastPath + 'GRIB/' + yearYesterday + '/'
+    records = [(today - timedelta(hours=1), gribPath + 'IQS' + yearYesterday + dateYesterday + '1200' + dateYesterday + '23001', run, None, 0),
+               (today, gribPath + 'IQS' + yearYesterday + dateYesterday + '1200' + dateToday + '00001', run, (faire, fflux, fwind), 0)]
+
+    gribPath = hindcastPath + 'GRIB/' + yearToday + '/'
+    for i in range(1, 24):
+        time_i = today + timedelta(hours=i); str1 = time_i.strftime('%m%d%H')
+
+        if i < 13: # From today's 00Z run
+            run = today
+            grib1 = 'IQS' + yearToday + dateToday + '0000' + str1 + '001'
+        else: # From today's 12Z run
+            run = today + timedelta(hours=12)
+            grib1 = 'IQS' + yearToday + dateToday + '1200' + str1 + '001'
+
+        records.append((time_i, gribPath + grib1, run, (faire, fflux, fwind), i))
+
+    for files, i in write_cycle(records, workers, crop, reader, memory.get('HC'), window):
+        logger.error(f"Exception while creating HC atmospheric forcing files at index {i}")
+
+    logger.info(' ')
+
+    ''' Process forecast '''
+    forecastPath = metpath + 'FC/'; logger.info(f'{now()} Creating ECMWF FC files...')
+    # Remove NetCDF files older than 3 days
+    clean(forecastPath, 3)
+    # Set path for NetCDF files
+    ncPath = forecastPath + 'NETCDF/'
+    if not os.path.isdir(ncPath):
+        os.makedirs(ncPath)
+
+    # Set start time for bulk forcing 
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    # Yesterday date is also needed to retrieve the name of some GRIB files
+    yesterday = today - timedelta(days=1)
+    # First, set up some useful date strings
+    yearYesterday = yesterday.strftime('%Y')
+    dateYesterday = yesterday.strftime('%m%d')
+    yearToday = today.strftime('%Y')
+    dateToday = today.strftime('%m%d')
+
+    # Time list for bulk forcing (24 hours, hourly)
+    time = np.arange(today, today+timedelta(days=4), timedelta(hours=1))
+    # Convert to days since offset
+    time = np.array([(to_datetime(i) - offset).total_seconds()/86400 for i in time])
+
+    gribPath = forecastPath + 'GRIB/'
+    # Define alternative path in case some file cannot be found
+    #gribPath2 = hindcastPath + 'GRIB/' + yearToday + '/'
+    #gribPath3 = hindcastPath + 'GRIB/' + yearYesterday + '/'
+
+    # All records come from yesterday's 12Z run. Step 11 is only needed to de-accumulate
+    run = yesterday + timedelta(hours=12)
+    time_0 = today - timedelta(hours=1); str0 = time_0.strftime('%m%d%H')
+    records = [(time_0, gribPath + 'IQS' + yearYesterday + dateYesterday + '1200' + str0 + '001', run, None, 0)]
+
+    for i in range(4):
+        time_i = today + timedelta(days=i)
+
+        ''' Setting output NetCDF file names '''
+        datestring = time_i.strftime('%Y%m%d')
+        fwind = ncPath + 'ECMWF_wind_' + datestring + '.nc' # Wind
+        fflux = ncPath + 'ECMWF_hf_'   + datestring + '.nc' # Radiation
+        faire = ncPath + 'ECMWF_air_'  + datestring + '.nc' # T, P, Q, rain
+
+        logger.info(f'{now()} Creating {basename(faire)}, {basename(fflux)}, {basename(fwind)}...')
+        create_bulk(faire, fflux, fwind, L, M, 24, 
+             offset, lon, lat, time[24*i:24*(i+1)])
+
+        # Hourly IQS files are available up to step 90. Then, the 1200 value (step 96) is in the IQD file
+        hours = range(7) if i == 3 else range(24)
+        for k in hours:
+            time_k = time_i + timedelta(hours=k); str1 = time_k.strftime('%m%d%H')
+
+            grib1 = gribPath + 'IQS' + yearYesterday + dateYesterday + '1200' + str1 + '001'
+            #if not os.path.isfile(grib1):
+            #    grib1 = gribPath2 + 'IQS' + yearYesterday + dateYesterday + '1200' + str1 + '001'
+            #    if not os.path.isfile(grib1):
+            #        grib1 = gribPath3 + 'IQS' + yearYesterday + dateYesterday + '1200' + str1 + '001'
+
+            records.append((time_k, grib1, run, (faire, fflux, fwind), k))
+
+        if i == 3:
+            k = 12; # 1200 value from IQD file
+
+            time_k = time_i + timedelta(hours=k); str1 = time_k.strftime('%m%d%H')
+            # Get full path of IQD file
+            grib1 = gribPath + 'IQD' + yearYesterday + dateYesterday + '1200' + str1 + '001'
+            #if not os.path.isfile(grib1):
+            #    grib1 = gribPath2 + 'IQD' + yearYesterday + dateYesterday + '1200' + str1 + '001'
+            #    if not os.path.isfile(grib1):
+            #        grib1 = gribPath3 + 'IQD' + yearYesterday + dateYesterday + '1200' + str1 + '001'
+
+            records.append((time_k, grib1, run, (faire, fflux, fwind), k))
+
+    # Write the whole forecast cycle. Accumulated fields are de-accumulated at once
+    for files, k in write_cycle(records, workers, crop, reader, memory.get('FC'), window):
+        logger.error(f"Exception while creating FC atmospheric forcing files at index {k}")
+
+    logger.info(' '); logger.info(f'{now()} Finished creating ECMWF ROMS forcing files')
+
+def clean(path, D):
+    ''' Removes files in path older than D days '''
+    old = time.time() - D * 86400
+    for f in glob.glob(path + '**/*.nc', recursive=True):
+        file = os.path.abspath(f)
+        if os.path.getctime(file) < old:
+            logger.info(f'{now()} Deleting {file}') 
+            os.remove(file)
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+from netCDF4 import Dataset
+import numpy as np
+import os
+
+from humidity import relative2specific
+
+long_name = dict(
+        MSL = 'mean_sea_level_pressure',
+        T2M = '2m_temperature',
+        TP = 'total_precipitation',
+        Q = 'specific_humidity',
+        SSR = 'surface_net_solar_radiation',
+        STRD = 'surface_thermal_radiation_downwards',
+        U10M = '10m_u_component_of_wind',
+        V10M = '10m_v_component_of_wind',
+        )
+
+# ECMWF variables needed for the CROCO online bulk forcing files
+INPUTS = ('Pair', 'Tair', 'Qair', 'rain', 'swrad', 'lwrad_down', 'Uwind', 'Vwind')
+
+def configuration():
+    ''' Read configuration file '''
+    config = {}
+    with open('config', 'r') as f:
+        for line in f:
+            if line.strip() and line[0] != '!': # Exclude comments and blank lines
+                # Ignore comments at the end of line
+                line = line.split('!')[0] 
+                # Split. Fist word is a keyword
+                out = line.split(); key = out[0]; val = out[1:]                                             
+                if len(val) == 1: # This is for sigle-valued keywords
+                    config[key] = val[0]
+                else: # This is for multiple-valued keywords
+                    config[key] = val
+    return config
+
+def crop_window(config, lon, lat):
+    ''' Index window (j0, j1, i0, i1) of the ECMWF grid (LON, LAT) that
+    covers the model boundaries, plus 0.1 degrees '''
+
+    # Get model boundaries
+    W, E = float(config.get('west'))-.1,  float(config.get('east'))+.1
+    S, N = float(config.get('south'))-.1, float(config.get('north'))+.1
+
+    i0, i1 = np.argmin(abs(lon - W)), np.argmin(abs(lon - E)) + 1
+    j0, j1 = np.argmin(abs(lat - S)), np.argmin(abs(lat - N)) + 1
+    return j0, j1, i0, i1
+
+def ecmwf2croco(faire, fflux, fwind, product):
+    ''' Generate CROCO online bulk forcing files of PRODUCT (fcnc or weekly) '''
+
+    config = configuration()
+
+    # Process AIR
+    with Dataset(faire, 'r') as nc:
+        # Read longitude and latitude
+        lon, lat = nc.variables['lon'][:], nc.variables['lat'][:]
+        j0, j1, i0, i1 = crop_window(config, lon, lat)
+        # Read time
+        time = nc.variables['pair_time'][:]
+
+    # Read the model area of the variables needed
+    data = {}
+    for f in (faire, fflux, fwind):
+        with Dataset(f, 'r') as nc:
+            for v in INPUTS:
+                if v in nc.variables:
+                    data[v] = nc.variables[v][:, j0:j1, i0:i1]
+
+    write_croco(os.path.dirname(faire), lon[i0:i1], lat[j0:j1], time, data, product)
+
+def write_croco(path, lon, lat, time, data, product):
+    ''' Write CROCO online bulk forcing files of PRODUCT to PATH. DATA are the
+    ECMWF variables in INPUTS, already cropped to LON, LAT. CROCO expects one
+    file per month and parameter. Each monthly file gets the records in that
+    month, plus the first record of the next month (if any), so that CROCO
+    can interpolate up to the end of the month. '''
+
+    offset = datetime.strptime(configuration().get('offset'), '%Y%m%d')
+
+    # Month of each record
+    dates = [offset + timedelta(seconds=round(86400 * float(t))) for t in time]
+    months = np.array([12 * i.year + i.month - 1 for i in dates])
+
+    # Convert all parameters at once, for all months
+    fields = {}
+    # Air pressure. Convert to Pascals
+    fields['MSL'] = 100 * data['Pair']
+    # Air temperature. Convert to Kelvin
+    fields['T2M'] = 273.15 + data['Tair']
+    # Relative humidity. Convert to specific humidity
+    fields['Q'] = relative2specific(fields['MSL'], fields['T2M'], data['Qair'])
+    # Total precipitation
+    fields['TP'] = data['rain']
+    # Radiation
+    fields['SSR'], fields['STRD'] = data['swrad'], data['lwrad_down']
+    # Wind
+    fields['U10M'], fields['V10M'] = data['Uwind'], data['Vwind']
+
+    for month in dict.fromkeys(months): # Months in order
+        index = np.where(months == month)[0]
+        records = slice(index[0], min(index[-1] + 2, len(time)))
+        year = month // 12
+        for name, field in fields.items():
+            create_cdf(path, lon, lat, time[records], field[records], name, year, month % 12 + 1,
+                    offset.strftime('days since %Y-%m-%d'), product)
+
+def create_cdf(path, lon, lat, time, data, name, year, month, offset, product):
+    ''' Create online bulk forcing monthly file, and list it in the log of PRODUCT '''
+
+    units = dict(
+            MSL = 'Pa', T2M = 'K', TP = 'kg m-2 s-1', Q = 'kg kg-1',
+            SSR = 'W m-2', STRD = 'W m-2', U10M = 'm s-1', V10M = 'm s-1')
+
+
+    filename = path + '/' + name + '_Y' + str(year) + 'M%02d' % month + '.nc'
+
+    with Dataset(filename, 'w', format='NETCDF4') as nc:
+        nc.createDimension('lon', len(lon))
+        nc.createDimension('lat', len(lat))
+        nc.createDimension('time', len(time))
+
+        lonvar = nc.createVariable('lon', 'f4', dimensions=('lon'))
+        lonvar.long_name = 'longitude of RHO-points'
+        lonvar.units = 'degree_east'
+        lonvar[:] = lon
+
+        latvar = nc.createVariable('lat', 'f4', dimensions=('lat'))
+        latvar.long_name = 'latitude of RHO-points'
+        latvar.units = 'degree_north'
+        latvar[:] = lat
+
+        timevar = nc.createVariable('time', 'f8', dimensions=('time'))
+        timevar.long_name = 'Time'
+        timevar.units = offset
+        timevar[:] = time
+
+        datavar = nc.createVariable(name, 'f4', dimensions=('time', 'lat', 'lon'))
+        datavar.long_name = long_name.get(name)
+        datavar.units = units.get(name)
+        datavar.missing_value = 9999
+        datavar[:] = data
+
+    with open(f'/log/bulk-{product}-abspath.config', 'a') as f:
+        f.write(f'{os.path.abspath(filename)}\n')
+    with open(f'/log/bulk-{product}-basename.config', 'a') as f:
+        f.write(f'{os.path.basename(filename)}\n')
@@ -0,0 +1,380 @@
+from datetime import datetime, timedelta
+from create_bulk import create_bulk
+from ecmwf2croco import ecmwf2croco, crop_window, write_croco, INPUTS
+from os.path import basename
+from netCDF4 import Dataset
+import numpy as np
+import os
+
+from log import set_logger, now
+
+logger = set_logger()
+
+# ECMWF variables in each type of daily file, and the name of their time variable
+VARIABLES = {'air_': ('pair_time', ('Pair', 'Tair', 'Qair', 'cloud', 'rain')),
+             'hf_': ('srf_time', ('swrad', 'lwrad', 'lwrad_down')),
+             'wind_': ('wind_time', ('Uwind', 'Vwind'))}
+
+# CROCO online bulk forcing products, and the daily files (HC or FC) they are made from.
+# fcnc: forecast catch-up run, from yesterday to days-ahead. weekly: hindcast, days-back
+# to today, taking FC files for the days not in hindcast yet.
+PRODUCTS = {'fcnc': 'FC', 'weekly': 'HC'}
+
+def to_datetime(date):
+    ''' Converts a numpy datetime64 to a Python datetime '''
+
+    timestamp = ((date - np.datetime64('1970-01-01T00:00:00'))
+                 / np.timedelta64(1, 's'))
+    return datetime.utcfromtimestamp(timestamp)
+
+def make_online(config, product, memory=None):
+    ''' Create the CROCO online bulk forcing files of PRODUCT (fcnc or weekly).
+    MEMORY holds the fields decoded by the daily bulk forcing in this same
+    process, as {'HC' or 'FC': {datetime: {variable: 2-D field}}}, for the
+    model area (crop_window) only. When the CROCO files are built directly
+    ("bulkdirect"), times found there are not read again from the daily
+    files. '''
+
+    ''' Setting time '''
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if product == 'fcnc':
+        # Set start time for FC bulk forcing. Extend it to yesterday 00:00 AM for the forecast catch-up run
+        start = today - timedelta(days=1)
+        # Time list for bulk forcing, to the end of days-ahead
+        DateTime = np.arange(start, start + timedelta(days=int(config.get('days-ahead'))+2), timedelta(hours=1))
+    else:
+        # Set start time for bulk forcing
+        start = today - timedelta(days=int(config.get('days-back')))
+        # Time list for bulk forcing, from the day before start to today 00:00
+        DateTime = np.arange(start-timedelta(days=1), today+timedelta(hours=1), timedelta(hours=1))
+    DateTime = np.array([to_datetime(i) for i in DateTime])
+    # Get CROCO refence time
+    offset = datetime.strptime(config.get('offset'), '%Y%m%d')
+    # Convert to days since offset
+    time = np.array([(i - offset).total_seconds()/86400 for i in DateTime])
+
+    # Set output directory to save NetCDF files
+    metpath = config.get('metpath')
+
+    source = PRODUCTS[product]
+    if source == 'FC':
+        # Set path for input (daily) NetCDF files
+        ncPathIn, fcpath = metpath + 'FC/NETCDF/', None
+    else:
+        # Set path for input (daily) NetCDF files, and the daily FC files for the days not in hindcast
+        ncPathIn, fcpath = metpath + 'HC/NETCDF/' + start.strftime('%Y') + '/', metpath + 'FC/NETCDF/'
+    # Set path for output NetCDF files
+    ncPathOut = ncPathIn + start.strftime('%Y%m%d') + '/'
+    if not os.path.isdir(ncPathOut):
+        os.makedirs(ncPathOut)
+
+    # Fields decoded in this process (model area only, so not for the ECMWF_frc_* files)
+    memory = (memory or {}).get(source) if config.get('bulkdirect') == 'T' else None
+
+    ''' Update the incremental store of daily HC fields, if set '''
+    stores = dict.fromkeys(VARIABLES)
+    if source == 'HC' and config.get('bulkstore'):
+        storepath = config.get('bulkstore') + '/'
+        if not os.path.isdir(storepath):
+            os.makedirs(storepath)
+        # Oldest time to keep in store [days since offset]
+        oldest = (today - timedelta(days=int(config.get('storedays'))) - offset).total_seconds()/86400
+        for namestr in VARIABLES:
+            stores[namestr] = update_store(ncPathIn, storepath, DateTime, namestr, oldest)
+
+    ''' Set ECMWF grid (from the daily files, which may be cropped to the model area) '''
+    with Dataset(stores['air_'] or daily_file(ncPathIn, fcpath, 'air_', DateTime[0].strftime('%Y%m%d')), 'r') as nc:
+        lon, lat = nc.variables['lon'][:], nc.variables['lat'][:]
+
+    ''' Convert to CROCO format '''
+    # CROCO online interpolation bulk forcing files follow certain conventions.
+    # Files must be produced for each month and parameter separately. If the
+    # simulation spans multiple months, each monthly file only gets the
+    # records of that month (see write_croco).
+
+    if os.path.isfile(f'/log/bulk-{product}-abspath.config'):
+        os.remove(f'/log/bulk-{product}-abspath.config')
+    if os.path.isfile(f'/log/bulk-{product}-basename.config'):
+        os.remove(f'/log/bulk-{product}-basename.config')
+
+    if config.get('bulkdirect') == 'T':
+        ''' Build the CROCO files straight from the daily files, reading the model area only '''
+        window = crop_window(config, lon, lat); j0, j1, i0, i1 = window
+        data = {}
+        for namestr, (t, variables) in VARIABLES.items():
+            data.update(read_daily(ncPathIn, fcpath, time, DateTime, namestr,
+                [v for v in variables if v in INPUTS], window, stores[namestr], memory))
+
+        write_croco(ncPathOut, lon[i0:i1], lat[j0:j1], time, data, product)
+        return
+
+    ''' Setting output NetCDF file names '''
+    datestring = start.strftime('%Y%m%d')
+    fwind = ncPathOut + 'ECMWF_frc_wind_' + datestring + '.nc' # Wind
+    fflux = ncPathOut + 'ECMWF_frc_hf_'   + datestring + '.nc' # Radiation
+    faire = ncPathOut + 'ECMWF_frc_air_'  + datestring + '.nc' # T, P, Q, rain
+
+    ''' Create forcing files '''
+    # Get dimensions
+    L, M, T = len(lon), len(lat),len(time)
+    # Create NetCDF files
+    logger.info(f'{now()} Creating {basename(faire)}, {basename(fflux)}, {basename(fwind)}')
+    create_bulk(faire, fflux, fwind, L, M, T, offset, lon, lat, time)
+
+    ''' MAIN LOOP '''
+    logger.info(' '); logger.info(f'{now()} Starting writing loop...')
+    concatenate(ncPathIn, fcpath, faire, time, DateTime, 'air_', stores['air_'])
+    concatenate(ncPathIn, fcpath, fflux, time, DateTime, 'hf_', stores['hf_'])
+    concatenate(ncPathIn, fcpath, fwind, time, DateTime, 'wind_', stores['wind_'])
+
+    ecmwf2croco(faire, fflux, fwind, product)
+
+def daily_file(path, fcpath, namestr, day):
+    ''' Daily NetCDF file of type NAMESTR for DAY (YYYYMMDD), from PATH
+    or, if not there, from the path of daily FC files FCPATH (if given) '''
+
+    inFile = path + 'ECMWF_' + namestr + day + '.nc'
+    if not os.path.isfile(inFile) and fcpath:
+        # Try path of daily FC files
+        inFile = fcpath + 'ECMWF_' + namestr + day + '.nc'
+    if not os.path.isfile(inFile):
+        raise FileNotFoundError(f'FATAL: Input file {inFile} is missing!')
+    return inFile
+
+def blocks(records, index):
+    ''' Split matching lists of input RECORDS and output INDEX into
+    contiguous blocks, as (input slice, output slice) pairs '''
+
+    breaks = np.where((np.diff(records) != 1) | (np.diff(index) != 1))[0] + 1
+    for r, w in zip(np.split(records, breaks), np.split(index, breaks)):
+        yield slice(r[0], r[-1] + 1), slice(w[0], w[-1] + 1)
+
+def create_store(src, filename):
+    ''' Create an empty store FILENAME with the same dimensions, variables
+    and attributes as the open NetCDF SRC (a daily file or another store).
+    Time is unlimited, so that new days can be appended, and time-dependent
+    fields are chunked by record. Each day in store is listed, with its first
+    time (day_time) and the modification time of its daily file (day_mtime). '''
+
+    with Dataset(filename, 'w', format='NETCDF4') as dst:
+        dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+
+        for name, dim in src.dimensions.items():
+            if name != 'day':
+                dst.createDimension(name, None if name == 'time' else len(dim))
+
+        for name, var in src.variables.items():
+            if 'day' in var.dimensions:
+                continue # Days in store, listed below
+            chunks = (1,) + var.shape[1:] if len(var.dimensions) > 1 and var.dimensions[0] == 'time' else None
+            out = dst.createVariable(name, var.datatype, var.dimensions, chunksizes=chunks,
+                    fill_value=getattr(var, '_FillValue', None))
+            out.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'})
+            if 'time' not in var.dimensions:
+                out[:] = var[:]
+
+        dst.createDimension('day', None)
+        dst.createVariable('day_time', 'f8', ('day',))
+        dst.createVariable('day_mtime', 'f8', ('day',))
+
+def append_store(store, inFile, records=slice(None)):
+    ''' Append RECORDS of every time-dependent variable in INFILE to STORE '''
+
+    with Dataset(inFile, 'r') as src, Dataset(store, 'a') as dst:
+        src.set_auto_maskandscale(False); dst.set_auto_maskandscale(False) # Copy raw values
+        n = len(dst.dimensions['time'])
+        for name, var in src.variables.items():
+            if var.dimensions and var.dimensions[0] == 'time':
+                data = var[records]
+                dst.variables[name][n:n + len(data)] = data
+
+def replace_store(store, inFile, t):
+    ''' Overwrite the records of INFILE in STORE, where T is the name of the
+    time variable. False if the store does not have the same records. '''
+
+    with Dataset(inFile, 'r') as src, Dataset(store, 'a') as dst:
+        src.set_auto_maskandscale(False); dst.set_auto_maskandscale(False) # Copy raw values
+        inTime, storeTime = src.variables[t][:], dst.variables[t][:]
+        n = np.searchsorted(storeTime, inTime[0] - 1e-6)
+        if n + len(inTime) > len(storeTime) or np.any(abs(storeTime[n:n + len(inTime)] - inTime) > 1e-6):
+            return False
+        for name, var in src.variables.items():
+            if var.dimensions and var.dimensions[0] == 'time':
+                dst.variables[name][n:n + len(inTime)] = var[:]
+    return True
+
+def tag_day(store, day, mtime):
+    ''' Set the modification time MTIME of the daily file of DAY (its first
+    time) in STORE, adding the day to the list if needed '''
+
+    with Dataset(store, 'a') as nc:
+        days = nc.variables['day_time'][:]
+        n = int(np.where(days == day)[0][0]) if np.any(days == day) else len(days)
+        nc.variables['day_time'][n] = day
+        nc.variables['day_mtime'][n] = mtime
+
+def same_grid(store, inFile):
+    ''' Whether STORE and the daily file INFILE have the same grid (e.g.
+    the same crop), and STORE lists its days '''
+
+    with Dataset(store, 'r') as a, Dataset(inFile, 'r') as b:
+        return 'day_time' in a.variables and all(a.variables[i].shape == b.variables[i].shape
+                and np.array_equal(a.variables[i][:], b.variables[i][:]) for i in ('lon', 'lat'))
+
+def update_store(path, storepath, DateTime, namestr, oldest):
+    ''' Update the incremental store of daily HC files of type NAMESTR in
+    STOREPATH. Daily files in PATH for the days in DateTime, which are
+    newer than the last record in the store (and not older than OLDEST),
+    are appended once. Days whose daily file has been written again since
+    (e.g. a rerun) are replaced, and the whole store is built again if the
+    grid of the daily files changes (e.g. a new "bulkgrid"). Then, records
+    older than OLDEST (days since offset) are dropped. Returns the path to
+    the store. '''
+
+    t = VARIABLES[namestr][0]
+    store = storepath + 'ECMWF_store_' + namestr.rstrip('_') + '.nc'
+
+    # Daily HC files of the days requested
+    inFiles = [path + 'ECMWF_' + namestr + day + '.nc' for day in dict.fromkeys(i.strftime('%Y%m%d') for i in DateTime)]
+    inFiles = [f for f in inFiles if os.path.isfile(f)]
+
+    if os.path.isfile(store) and inFiles and not same_grid(store, inFiles[0]):
+        logger.info(f'{now()} Grid changed. Building {basename(store)} again')
+        os.remove(store)
+
+    last, days = -np.inf, {}
+    if os.path.isfile(store):
+        with Dataset(store, 'r') as nc:
+            if len(nc.variables[t]):
+                last = nc.variables[t][-1]
+            days = dict(zip(nc.variables['day_time'][:].tolist(), nc.variables['day_mtime'][:].tolist()))
+
+    for inFile in inFiles:
+        mtime = os.path.getmtime(inFile)
+        with Dataset(inFile, 'r') as nc:
+            inTime = nc.variables[t][:]
+            if inTime[-1] < oldest:
+                continue # Too old to keep
+            day = float(inTime[0])
+            if day in days:
+                if days[day] == mtime:
+                    continue # Already in store
+            elif inTime[0] <= last:
+                continue # Missing from store, and older than the last day. Use the daily file
+            elif not os.path.isfile(store):
+                create_store(nc, store)
+
+        if day in days:
+            logger.info(f'{now()} Replacing {basename(inFile)} in {basename(store)}')
+            if not replace_store(store, inFile, t):
+                logger.info(f'{now()} Records changed. Building {basename(store)} again')
+                os.remove(store)
+                return update_store(path, storepath, DateTime, namestr, oldest)
+        else:
+            logger.info(f'{now()} Appending {basename(inFile)} to {basename(store)}')
+            append_store(store, inFile)
+            last = inTime[-1]
+        tag_day(store, day, mtime); days[day] = mtime
+
+    if not os.path.isfile(store):
+        return None
+
+    # Drop old records, rewriting the store
+    with Dataset(store, 'r') as nc:
+        time = nc.variables[t][:]
+        first = np.searchsorted(time, oldest)
+        if first == len(time):
+            first = None # All records are too old
+        elif first:
+            logger.info(f'{now()} Dropping {first} old records from {basename(store)}')
+            create_store(nc, store + '.tmp')
+            oldest = time[first] - 1e-6 # First time kept
+    if first is None:
+        os.remove(store)
+        return None
+    if first:
+        append_store(store + '.tmp', store, slice(first, None))
+        for day, mtime in days.items():
+            if day >= oldest:
+                tag_day(store + '.tmp', day, mtime)
+        os.replace(store + '.tmp', store)
+
+    return store
+
+def daily_blocks(path, fcpath, time, DateTime, namestr, store=None, memory=None):
+    ''' Map each time in TIME to a (source, record) pair, for variables of
+    type NAMESTR (air_, hf_ or wind_). Times decoded in this process (in
+    MEMORY, if given) are taken from there, times found in the incremental
+    STORE (if given) from the store, and the rest from the daily files in
+    PATH (or FCPATH). Then, yield each contiguous block of records, as
+    (source variables, input slice, output slice), opening each file once.
+    Blocks from MEMORY only have the INPUTS, already cut to the model area,
+    and no input slice (None) '''
+
+    t, variables = VARIABLES[namestr]
+    inputs = [v for v in variables if v in INPUTS]
+
+    # Map each time to a file: first, the fields in memory
+    files = np.full(len(time), '', dtype=object)
+    if memory:
+        found = np.array([i in memory and all(v in memory[i] for v in inputs) for i in DateTime])
+        if found.any():
+            for r, w in blocks(np.where(found)[0], np.where(found)[0]):
+                logger.info(f'{now()}   Taking {DateTime[w.start].strftime("%Y%m%d %H:%M")} - '
+                        f'{DateTime[w.stop-1].strftime("%Y%m%d %H:%M")} from memory')
+                yield {v: np.stack([memory[i][v] for i in DateTime[w]]) for v in inputs}, None, w
+        files[found] = 'memory'
+
+    # Then, the store
+    if store:
+        with Dataset(store, 'r') as nc:
+            storeTime = nc.variables[t][:]
+        if len(storeTime):
+            found = abs(storeTime[np.argmin(abs(storeTime[np.newaxis, :] - time[:, np.newaxis]), axis=1)] - time) <= 1e-6
+            files[found & (files == '')] = store
+
+    # Then, daily files
+    days = np.array([i.strftime('%Y%m%d') for i in DateTime])
+    for day in dict.fromkeys(days[files == '']):
+        files[(days == day) & (files == '')] = daily_file(path, fcpath, namestr, day)
+
+    for inFile in dict.fromkeys(files[files != 'memory']): # Files in order
+        index = np.where(files == inFile)[0]
+
+        with Dataset(inFile, 'r') as nc:
+            inTime = nc.variables[t][:]
+            # Find the required time records in this file
+            records = np.argmin(abs(inTime[np.newaxis, :] - time[index, np.newaxis]), axis=1)
+            missing = abs(inTime[records] - time[index]) > 1e-6
+            if missing.any():
+                raise IndexError(f'FATAL: {time[index][missing][0]} not found in {inFile}')
+
+            for r, w in blocks(records, index):
+                logger.info(f'{now()}   Reading {DateTime[w.start].strftime("%Y%m%d %H:%M")} - '
+                        f'{DateTime[w.stop-1].strftime("%Y%m%d %H:%M")} from {basename(inFile)}')
+                yield nc.variables, r, w
+
+def concatenate(path, fcpath, file, time, DateTime, namestr, store=None):
+    ''' Copy all variables of type NAMESTR into FILE, from the daily files
+    (or the STORE), for the whole TIME list. Contiguous blocks
+    of records are copied in a single slab write per variable. '''
+
+    with Dataset(file, 'a') as cdf:
+        for source, r, w in daily_blocks(path, fcpath, time, DateTime, namestr, store):
+            for v in VARIABLES[namestr][1]:
+                cdf.variables[v][w, :, :] = source[v][r, :, :]
+
+def read_daily(path, fcpath, time, DateTime, namestr, variables, window, store=None, memory=None):
+    ''' Read VARIABLES of type NAMESTR from the daily files (or the STORE,
+    or MEMORY), for the whole TIME list. Only the lat/lon WINDOW (j0, j1,
+    i0, i1) is read, which is the area of the fields in MEMORY. '''
+
+    j0, j1, i0, i1 = window
+
+    data = {}
+    for source, r, w in daily_blocks(path, fcpath, time, DateTime, namestr, store, memory):
+        for v in variables:
+            if v not in data:
+                data[v] = np.ma.masked_all((len(time), j1 - j0, i1 - i0), source[v].dtype)
+            data[v][w] = source[v] if r is None else source[v][r, j0:j1, i0:i1]
+    return data
@@ -0,0 +1,120 @@
+import numpy as np
+import argparse
+import time
+import sys
+
+# Constants, as defined in MetPy
+SAT_PRESSURE_0C = 611.2          # Saturation vapor pressure at 0 degC [Pa]
+ZERO_DEGC = 273.15               # [K]
+T0 = 273.16                      # Triple point of water [K]
+LV = 2500840.0                   # Latent heat of vaporization at T0 [J kg-1]
+CP_L = 4219.400000000001         # Specific heat of liquid water [J kg-1 K-1]
+CP_V = 1860.078011865639         # Specific heat of water vapor [J kg-1 K-1]
+RV = 461.52311572606084          # Gas constant of water vapor [J kg-1 K-1]
+EPSILON = 0.6219569100577033     # Molecular weight ratio, water vapor to dry air
+
+# Records (time steps) converted at a time
+CHUNK = 24
+
+def saturation_vapor_pressure(T):
+    ''' Saturation vapor pressure [Pa] over liquid water at temperature
+    T [K], as in MetPy (Ambaum, 2020, Eq. 13) '''
+
+    # Latent heat of vaporization at T (Eq. 15)
+    L = LV - (CP_L - CP_V) * (T - T0)
+
+    e = T0 / T
+    e **= (CP_L - CP_V) / RV
+    L /= T; np.subtract(LV / T0, L, out=L); L /= RV
+    e *= np.exp(L, out=L)
+    e *= SAT_PRESSURE_0C
+    return e
+
+def specific_humidity(MSL, T2M, RH):
+    ''' Specific humidity [kg kg-1] from air pressure MSL [Pa], temperature
+    T2M [K] and relative humidity RH [%]. Same formulation as MetPy's
+    dewpoint_from_relative_humidity and specific_humidity_from_dewpoint,
+    evaluated in place to keep temporaries to a minimum. '''
+
+    # Vapor pressure [Pa]
+    e = saturation_vapor_pressure(T2M)
+    e *= RH; e /= 100
+
+    # Dewpoint [K], inverting Bolton (1980)
+    e /= SAT_PRESSURE_0C; val = np.log(e, out=e)
+    d = 17.67 - val
+    val *= 243.5; val /= d; val += ZERO_DEGC
+
+    # Saturation mixing ratio at dewpoint. Undefined if not below air pressure
+    es = saturation_vapor_pressure(val)
+    np.subtract(MSL, es, out=d)
+    undefined = d <= 0
+    es *= EPSILON; es /= d
+    es[undefined] = np.nan
+
+    # Specific humidity, from mixing ratio
+    np.add(1, es, out=d); es /= d
+    return es
+
+def relative2specific(MSL, T2M, Q):
+    ''' Convert relative humidity to specific humidity. Inputs are (time,
+    lat, lon) arrays, which are processed in chunks of CHUNK records.
+    Points masked in any input are masked in the result. '''
+
+    data = [np.ma.getdata(i) for i in (MSL, T2M, Q)]
+
+    q = np.empty(np.shape(Q))
+    for i in range(0, len(q), CHUNK):
+        chunk = slice(i, i + CHUNK)
+        q[chunk] = specific_humidity(*(np.asarray(j[chunk], dtype=np.float64) for j in data))
+
+    mask = np.ma.getmask(MSL) | np.ma.getmask(T2M) | np.ma.getmask(Q)
+    if np.any(mask):
+        return np.ma.masked_array(q, mask=mask)
+    return q
+
+def main():
+
+    msg = ''' Validate the specific humidity calculation against MetPy on a recorded
+              bulk forcing file (e.g. ECMWF_frc_air_YYYYMMDD.nc or a daily ECMWF_air
+              file), and compare their run times. Fails (exit status 1) if the
+              relative difference is larger than the tolerance. MetPy is only needed
+              here. '''
+
+    # Initialize argument parser
+    parser = argparse.ArgumentParser(description=msg)
+    # Define command-line arguments
+    parser.add_argument('file', help='Bulk forcing file with Pair [mb], Tair [C] and Qair [%%]')
+    parser.add_argument('--tolerance', type=float, default=1e-6, help='Allowed relative difference')
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
+    from metpy.calc import dewpoint_from_relative_humidity
+    from metpy.calc import specific_humidity_from_dewpoint
+    from metpy.units import units
+    from netCDF4 import Dataset
+
+    with Dataset(args.file, 'r') as nc:
+        MSL = 100 * nc.variables['Pair'][:]
+        T2M = 273.15 + nc.variables['Tair'][:]
+        RH = nc.variables['Qair'][:]
+
+    start = time.perf_counter()
+    dewpoint = dewpoint_from_relative_humidity(units.Quantity(T2M, 'degK'), units.Quantity(RH, 'percent'))
+    reference = specific_humidity_from_dewpoint(units.Quantity(MSL, 'pascal'), dewpoint).m_as('')
+    elapsed = time.perf_counter() - start
+    print(f'{"metpy":>10s}: {elapsed:9.3f} s')
+
+    start = time.perf_counter()
+    q = relative2specific(MSL, T2M, RH)
+    elapsed = time.perf_counter() - start
+    print(f'{"numpy":>10s}: {elapsed:9.3f} s')
+
+    difference = np.nanmax(np.abs(q - reference) / np.abs(reference))
+    print(f'Maximum relative difference: {difference:.3e}')
+    if not difference <= args.tolerance:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
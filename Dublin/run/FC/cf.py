@@ -1,14 +1,10 @@
+from scoordinate import SCOORD, s_levels, stretching
 from datetime import datetime
 from netCDF4 import Dataset
-import numpy as np
 import argparse
 import glob
 import os
 
-def scoord(N):
-    l = np.linspace(-1, 0, N+1)
-    return .5*(l[0:-1] + l[1:])
-
 def OpenDriftCompliant(file, offset, destpath):
     ''' 
         Takes a CROCO history file and creates a copy that is OpenDrift compliant.
@@ -43,14 +39,18 @@ def OpenDriftCompliant(file, offset, destpath):
         Vtransform = ng.variables['Vtransform'][:]
         # Read critical depth
         hc = ng.variables['hc'][:]
+        # Get number of vertical levels
+        N = nf.dimensions['s_rho'].size
         # Read stretching curves at RHO points
         try:
             Cs_r = ng.variables['Cs_r'][:]
         except KeyError:
-            Cs_r = ng.variables['Cs_rho'][:]
+            try:
+                Cs_r = ng.variables['Cs_rho'][:]
+            except KeyError:
+                # Not in grid file. Use the S-coordinate parameters of the history file
+                Cs_r = stretching('r', float(nf.theta_s), float(nf.theta_b), N, SCOORD[int(Vtransform)])
         
-        # Get number of vertical levels
-        N = nf.dimensions['s_rho'].size
         # Get number of time records
         T = nf.dimensions['time'].size
         
@@ -93,7 +93,7 @@ def OpenDriftCompliant(file, offset, destpath):
         svar.standard_name = 'ocean_s_coordinate_g2'
         svar.Vtransform = Vtransform
         svar.formula_terms = 's: s_rho C: Cs_rho eta: zeta depth: h depth_c: hc'
-        svar[:] = scoord(N)
+        svar[:] = s_levels('r', N)
         
         # S-stretching curves
         csvar = nc.createVariable('Cs_r', 'f8', dimensions=('s_rho',))
@@ -36,15 +36,20 @@ sshpass -p ${password} scp croco.in ${username}@${ip}:${hpcdir} # Copy to HPC
 rm croco.in # Remove local file
 
 # ONLINE BULK FORCING
-docker cp bulk-fcnc:/log/bulk-fcnc-abspath.config .
+# Made by bulk-daily (bulkproducts in config) or by bulk-fcnc. Take the one that listed them today
+for bulk in bulk-daily bulk-fcnc
+do
+	[ -n "$(docker exec ${bulk} find /log -name bulk-fcnc-abspath.config -newermt ${today})" ] && break
+done
+docker cp ${bulk}:/log/bulk-fcnc-abspath.config .
 input="bulk-fcnc-abspath.config"
 while IFS= read -r line
 do
-	docker cp bulk-fcnc:$line . # Copy from container
+	docker cp ${bulk}:$line . # Copy from container
 done < "$input"
 rm "$input"
 
-docker cp bulk-fcnc:/log/bulk-fcnc-basename.config .
+docker cp ${bulk}:/log/bulk-fcnc-basename.config .
 input="bulk-fcnc-basename.config"
 while IFS= read -r line
 do
@@ -0,0 +1,129 @@
+from functools import lru_cache
+import numpy as np
+
+# CROCO vertical transformation equation (Vtransform) to S-coordinate type
+SCOORD = {1: 'old1994', 2: 'new2008'}
+
+@lru_cache(maxsize=None)
+def s_levels(point_type, N):
+    '''
+    s_levels returns the sigma coordinate at either rho or w points
+
+    Inputs:
+      point_type        'r' or 'w'
+      N                 number of vertical rho-points
+
+    Outputs:
+      sc                sigma coordinate (read-only, cached)
+    '''
+    N = np.float64(N)
+    if 'w' in point_type:
+        sc = (np.arange(N+1,dtype=np.float64)-N)/N
+    else:
+        sc = ((np.arange(1,N+1,dtype=np.float64))-N-0.5)/N
+    sc.setflags(write=False)
+    return sc
+
+@lru_cache(maxsize=None)
+def stretching(point_type, theta_s, theta_b, N, scoord='new2008'):
+    '''
+    stretching returns the S-coordinate stretching curve at either rho or w
+    points. Results are cached, since they only depend on these parameters.
+
+    Inputs:
+      point_type        'r' or 'w'
+      theta_s           surface focusing parameter
+      theta_b           bottom focusing parameter
+      N                 number of vertical rho-points
+      scoord            'new2008' :new scoord 2008  or 'old1994' for Song scoord
+
+    Outputs:
+      Cs                Cs parameter (read-only, cached)
+    '''
+    sc = s_levels(point_type, N)
+
+    if scoord == 'new2008':
+        # Allows use of theta_b > 0 (July 2009)
+        one64 = np.float64(1)
+        if theta_s > 0.:
+            csrf = ((one64-np.cosh(theta_s*sc))
+                       /(np.cosh(theta_s)-one64))
+        else:
+            csrf = -sc**2
+        sc1 = csrf+one64
+        if theta_b > 0.:
+            Cs = ((np.exp(theta_b*sc1)-one64)
+                /(np.exp(theta_b)-one64)-one64)
+        else:
+            Cs = csrf
+    elif scoord == 'old1994':
+        cff1 = 1./np.sinh(theta_s)
+        cff2 = 0.5/np.tanh(0.5*theta_s)
+        Cs = (1.-theta_b)*cff1*np.sinh(theta_s*sc)+ \
+           theta_b*(cff2*np.tanh(theta_s*(sc+0.5))-0.5)
+    else:
+        raise Exception("Unknown scoord, should be 'new2008' or 'old1994'")
+
+    Cs.setflags(write=False)
+    return Cs
+
+def scoord2z(point_type, zeta, topo, theta_s, theta_b, N, hc, scoord='new2008', Dcrit=0.2):
+    '''
+    scoord2z finds z at either rho or w points (positive up, zero at rest surface)
+
+    Inputs:
+      point_type        'r' or 'w'
+      zeta              sea surface height. Either a number, an array with
+                        the same shape as topo, or an array with a leading
+                        time dimension (time-varying sea level)
+      topo              array of depths (e.g., from grd file)
+      theta_s           surface focusing parameter
+      theta_b           bottom focusing parameter
+      N                 number of vertical rho-points
+      hc                critical depth
+      scoord            'new2008' :new scoord 2008  or 'old1994' for Song scoord
+
+    Outputs:
+      z                 depth, with shape ([time,] level, topo.shape...)
+      Cs                Cs parameter
+      sc                sigma coordinate
+
+    All levels (and times) are computed at once. Inputs are not modified.
+    '''
+    sc = s_levels(point_type, int(N))
+    Cs = stretching(point_type, float(theta_s), float(theta_b), int(N), scoord)
+
+    topo = np.asarray(topo)
+    zeta = np.asarray(zeta)
+
+    # Broadcast S-levels against the horizontal dimensions
+    levels = (-1,) + (1,)*topo.ndim
+    if zeta.ndim > topo.ndim: # case zeta is 3-D (in time)
+        zeta = zeta[:, np.newaxis]
+
+    if scoord == 'new2008':
+        # Minimum water depth
+        zeta = np.maximum(zeta, Dcrit-topo)
+
+        hinv = 1. / (abs(topo) + hc)
+        cff = (hc * sc).reshape(levels)
+        cff1 = Cs.reshape(levels)
+
+        z = zeta+(zeta+topo)* \
+            (cff+cff1*abs(topo))*hinv
+        if 'w' in point_type and zeta.ndim > topo.ndim:
+            z[:,0] = -topo
+
+    else: # 'old1994'
+        topo = np.where(topo==0, 1.e-2, topo)
+        # Minimum water depth
+        zeta = np.maximum(zeta, Dcrit-topo)
+
+        hinv = 1./topo
+        cff = (hc*(sc-Cs)).reshape(levels)
+        cff1 = Cs.reshape(levels)
+
+        z0 = cff+cff1*topo
+        z = z0+zeta*(1.+z0*hinv)
+
+    return np.asarray(z, dtype=np.float64).squeeze(), np.float32(Cs), sc.copy()